@@ -0,0 +1,229 @@
+"""End-to-end load benchmark of the v1 API
+
+Runs `main.app` in-process (through `httpx.ASGITransport`) against local stand-ins of
+its backends (see `stand_ins`), drives concurrent load at every v1 route (authenticated
+ones with generated JWTs) and writes a JSON report of p50/p95/p99 latency, throughput
+and (optionally) allocations per route.
+
+Usage:
+------
+```
+python -m benchmarks.load --requests 2000 --concurrency 32 --output report.json
+python -m benchmarks.load --baseline report.json --fail-on-regression
+python -m benchmarks.load --mongodb mongodb://localhost:27017/bench --redis redis://localhost:6379/15
+```
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+import tracemalloc
+from typing import Callable
+
+from . import report, stand_ins
+
+
+
+USER_AGENT = "benchmark/1.0"
+
+
+class Fixture:
+    """Seeded data the requests are built from"""
+    def __init__(self, podcasts:list[dict], users:list[tuple[str, dict]], seed:int):
+        self.podcasts = podcasts  # [{"id": str, "episodes": [str, ...]}]
+        self.users = users        # [(user id, auth headers)]
+        self.random = random.Random(seed)
+
+    def podcast(self) -> dict:
+        return self.random.choice(self.podcasts)
+
+    def episode(self) -> tuple[str, str]:
+        podcast = self.podcast()
+        return podcast["id"], self.random.choice(podcast["episodes"])
+
+    def user(self) -> dict:
+        return self.random.choice(self.users)[1]
+
+
+# name -> builder of (method, url, json body, headers) of one request
+Scenario = Callable[[Fixture], tuple[str, str, dict|None, dict|None]]
+
+def _episode_url(fixture:Fixture, suffix:str="") -> str:
+    podcast_id, episode_id = fixture.episode()
+    return f"/v1/podcast/{podcast_id}/episode/{episode_id}{suffix}"
+
+def _batch(fixture:Fixture) -> dict:
+    operations = []
+    for _ in range(10):
+        podcast_id, episode_id = fixture.episode()
+        action = fixture.random.choice(("like", "unlike", "subscribe", "unsubscribe"))
+        operations.append({"action": action, "podcast_id": podcast_id, "episode_id": episode_id})
+    return {"operations": operations}
+
+SCENARIOS : dict[str, Scenario] = {
+    "GET /v1/podcasts": lambda f: ("GET", "/v1/podcasts", None, None),
+    "GET /v1/podcasts?stream": lambda f: ("GET", "/v1/podcasts?stream=true", None, None),
+    "GET /v1/podcast/{id}": lambda f: ("GET", f"/v1/podcast/{f.podcast()['id']}", None, None),
+    "GET /v1/podcast/{id}/episodes": lambda f: ("GET", f"/v1/podcast/{f.podcast()['id']}/episodes", None, None),
+    "GET /v1/podcast/{id}/episode/{id}": lambda f: ("GET", _episode_url(f), None, None),
+    "GET /v1/podcast/{id}/episode/{id}/likes": lambda f: ("GET", _episode_url(f, "/likes"), None, None),
+    "GET /v1/podcast/{id}/episode/{id}/like": lambda f: ("GET", _episode_url(f, "/like"), None, f.user()),
+    "POST /v1/podcast/{id}/episode/{id}/like": lambda f: ("POST", _episode_url(f, "/like"), None, f.user()),
+    "POST /v1/podcast/{id}/episode/{id}/unlike": lambda f: ("POST", _episode_url(f, "/unlike"), None, f.user()),
+    "POST /v1/podcast/{id}/subscribe/": lambda f: ("POST", f"/v1/podcast/{f.podcast()['id']}/subscribe/", None, f.user()),
+    "POST /v1/podcast/{id}/unsubscribe/": lambda f: ("POST", f"/v1/podcast/{f.podcast()['id']}/unsubscribe/", None, f.user()),
+    "GET /v1/podcast/{id}/subscribers": lambda f: ("GET", f"/v1/podcast/{f.podcast()['id']}/subscribers", None, None),
+    "GET /v1/subscriptions": lambda f: ("GET", "/v1/subscriptions", None, f.user()),
+    "GET /v1/feed": lambda f: ("GET", "/v1/feed", None, f.user()),
+    "POST /v1/interactions:batch": lambda f: ("POST", "/v1/interactions:batch", _batch(f), f.user()),
+    "GET /v1/update/": lambda f: ("GET", "/v1/update/", None, None),
+}
+
+
+
+async def seed(args) -> Fixture:
+    """Syncs the synthetic catalog into the database and opens sessions of generated users"""
+    import httpx
+    from bson import ObjectId
+    from auth.jwt_auth.jwt_auth import JWTAuth
+    from db.podcasts import podcast_service, podcasts_collection
+    from db.sync import update_db
+    from services import RedisService
+
+    podcast_service.base_url = stand_ins.CATALOG_URL
+    podcast_service.http_client = httpx.AsyncClient(
+        transport=stand_ins.catalog_transport(args.podcasts, args.episodes)
+    )
+    await update_db()
+    podcasts = [
+        {"id": str(podcast["_id"]), "episodes": [str(episode["id"]) for episode in podcast["episodes"]]}
+        async for podcast in podcasts_collection.find(projection={"episodes.id":1})
+    ]
+
+    jwt_auth = JWTAuth()
+    redis = RedisService()
+    users = []
+    for _ in range(args.users):
+        user_id = str(ObjectId())
+        jti, access_token, _ = jwt_auth.generate_tokens(user_id)
+        await redis.set(f"{user_id}|{jti}", USER_AGENT)
+        users.append((user_id, {"Authorization": f"Token {access_token}"}))
+    return Fixture(podcasts, users, args.seed)
+
+
+async def run_scenario(client, fixture:Fixture, scenario:Scenario, args) -> dict:
+    async def send():
+        method, url, body, headers = scenario(fixture)
+        started = time.perf_counter()
+        response = await client.request(method, url, json=body, headers=headers)
+        await response.aread()
+        return time.perf_counter() - started, response.status_code
+
+    for _ in range(args.warmup):
+        await send()
+
+    latencies = []
+    errors = 0
+    remaining = args.requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            try:
+                latency, status = await send()
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(latency)
+            errors += status >= 400
+
+    if args.allocations:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    result = report.summarize(latencies, errors, time.perf_counter() - started)
+    if args.allocations:
+        current, peak = tracemalloc.get_traced_memory()
+        result["alloc_peak_kib"] = round((peak - before) / 1024, 1)
+        result["alloc_retained_kib"] = round((current - before) / 1024, 1)
+    return result
+
+
+async def main(args) -> dict:
+    backends = stand_ins.install(args.mongodb, args.redis)
+    import httpx
+    import main as service
+
+    fixture_started = time.perf_counter()
+    async with service.lifespan(service.app):
+        fixture = await seed(args)
+        setup_duration = time.perf_counter() - fixture_started
+        # app errors are answered with a 500 (and counted), as a server would do
+        transport = httpx.ASGITransport(app=service.app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench", headers={"User-Agent": USER_AGENT}
+        ) as client:
+            if args.allocations:
+                tracemalloc.start()
+            benchmarks = {}
+            for name, scenario in SCENARIOS.items():
+                if args.routes and not any(pattern in name for pattern in args.routes):
+                    continue
+                benchmarks[name] = await run_scenario(client, fixture, scenario, args)
+                print(f"{name:<55} {benchmarks[name]}", file=sys.stderr)
+            if args.allocations:
+                tracemalloc.stop()
+    return {
+        "suite": "load",
+        "environment": report.environment(),
+        "config": {
+            "backends": backends, "podcasts": args.podcasts, "episodes": args.episodes,
+            "users": args.users, "requests": args.requests, "concurrency": args.concurrency,
+            "warmup": args.warmup, "seed": args.seed, "setup_seconds": round(setup_duration, 3),
+        },
+        "benchmarks": benchmarks,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--mongodb", help="url of a local mongod (in-memory fake if not given)")
+    parser.add_argument("--redis", help="url of a local redis (in-memory fake if not given)")
+    parser.add_argument("--podcasts", type=int, default=200, help="size of the synthetic catalog")
+    parser.add_argument("--episodes", type=int, default=20, help="episodes of each podcast")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=1000, help="measured requests per route")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--routes", nargs="*", help="only routes containing any of these strings")
+    parser.add_argument("--allocations", action="store_true", help="trace allocations (slows requests down)")
+    parser.add_argument("--output", help="report path (stdout if not given)")
+    parser.add_argument("--baseline", help="report to compare with")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change counted as regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    return parser.parse_args(argv)
+
+
+def run(argv=None) -> int:
+    args = parse_args(argv)
+    result = asyncio.run(main(args))
+    changes = []
+    if args.baseline:
+        baseline = report.load(args.baseline)
+        if report.comparable_config(baseline) != report.comparable_config(result):
+            print("WARNING: baseline was run with a different configuration", file=sys.stderr)
+        changes = report.compare(result, baseline, args.threshold)
+        result["comparison"] = changes
+        report.print_comparison(changes)
+    report.dump(result, args.output)
+    if args.fail_on_regression and any(change["regression"] for change in changes):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,95 @@
+"""Summaries of benchmark samples and their comparison with a baseline report"""
+import json
+import platform
+import sys
+import time
+
+
+
+def percentile(sorted_samples:list[float], fraction:float) -> float:
+    """Nearest-rank percentile of already sorted samples"""
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, max(0, round(fraction * len(sorted_samples)) - 1))
+    return sorted_samples[index]
+
+
+def summarize(latencies:list[float], errors:int, duration:float) -> dict:
+    """Latency percentiles (ms) and throughput of one benchmark"""
+    samples = sorted(latencies)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "p50_ms": round(percentile(samples, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 0.99) * 1000, 3),
+        "throughput_rps": round(len(samples) / duration, 1) if duration else 0.0,
+    }
+
+
+def environment() -> dict:
+    return {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def comparable_config(report:dict) -> dict:
+    """Configuration of a report without the fields that vary between identical runs"""
+    return {key: value for key,value in report.get("config", {}).items() if not key.endswith("_seconds")}
+
+
+# metric -> True if a higher value is worse
+COMPARED_METRICS = {
+    "ms": True, "p50_ms": True, "p95_ms": True, "p99_ms": True, "throughput_rps": False, "alloc_peak_kib": True,
+}
+
+def compare(report:dict, baseline:dict, threshold:float) -> list[dict]:
+    """Relative changes of every benchmark that is in both reports
+
+    Returns:
+    --------
+    `list[dict]`: `{"benchmark", "metric", "baseline", "current", "change", "regression"}` items
+    """
+    changes = []
+    for name, current in report["benchmarks"].items():
+        previous = baseline.get("benchmarks", {}).get(name)
+        if previous is None:
+            continue
+        for metric, higher_is_worse in COMPARED_METRICS.items():
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change if higher_is_worse else -change
+            changes.append({
+                "benchmark": name, "metric": metric, "baseline": old, "current": new,
+                "change": round(change, 4), "regression": worse > threshold,
+            })
+    return changes
+
+
+def print_comparison(changes:list[dict], file=sys.stderr):
+    width = max((len(item["benchmark"]) for item in changes), default=0)
+    for item in changes:
+        flag = "REGRESSION" if item["regression"] else ""
+        print(
+            f"{item['benchmark']:<{width}} {item['metric']:<15} {item['baseline']:>12} -> "
+            f"{item['current']:>12} ({item['change']:+.1%}) {flag}",
+            file=file,
+        )
+
+
+def load(path:str) -> dict:
+    with open(path) as file:
+        return json.load(file)
+
+
+def dump(report:dict, path:str|None):
+    content = json.dumps(report, indent=2)
+    if path:
+        with open(path, "w") as file:
+            file.write(content + "\n")
+    else:
+        print(content)
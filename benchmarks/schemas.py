@@ -0,0 +1,196 @@
+"""Microbenchmarks of the schemas on the request paths, at realistic document sizes
+
+Times `Podcast`/`Episode` validation and dumping (and the ObjectId validators and
+serializers of their items), the raw document fast path (`schemas.encoding`) and
+`Result` construction/dumping for podcasts of 10 to 50k episodes. Likes and
+subscriptions are not embedded anymore (episodes and podcasts only keep their
+`likes_count`/`subscriber_count`), so the big embedded list of a podcast is its episodes.
+
+Every run is appended to a JSON lines history file (`benchmarks/history/`, ignored by
+git as results are machine specific), so results can be tracked over
+time; a scaling exponent of each benchmark between consecutive sizes shows where the
+cost stops growing linearly.
+
+Usage:
+------
+```
+python -m benchmarks.schemas                 # full grid, appended to the history
+python -m benchmarks.schemas --quick --no-history
+```
+"""
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Callable
+
+from . import report
+
+
+
+EPISODES = (10, 1_000, 10_000, 50_000)
+QUICK_EPISODES = (10, 1_000)
+COMMENTS = 2  # comments of each episode
+DEFAULT_HISTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "history", "schemas.jsonl")
+
+
+def podcast_document(episodes:int, comments:int=COMMENTS) -> dict:
+    """Raw podcast document as it is read from Motor"""
+    from bson import ObjectId
+    now = datetime.utcnow()
+    return {
+        "_id": ObjectId(),
+        "api_identifier": 1,
+        "fingerprint": "0" * 40,
+        "subscriber_count": 1_000,
+        "episodes": [
+            {
+                "api_identifier": index,
+                "likes_count": index % 100,
+                "comments": [
+                    {"user": ObjectId(), "date": now, "content": "nice episode"} for _ in range(comments)
+                ],
+                "id": ObjectId(),
+            }
+            for index in range(episodes)
+        ],
+    }
+
+
+def measure(func:Callable, min_time:float) -> float:
+    """Best time (seconds) of one call, repeating the call for at least `min_time` seconds"""
+    best = math.inf
+    total = 0.0
+    runs = 0
+    while total < min_time or runs < 3:
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = min(best, elapsed)
+        total += elapsed
+        runs += 1
+        if runs >= 1000:
+            break
+    return best
+
+
+def cases(document:dict) -> dict[str, Callable]:
+    from schemas import CommentStruct, Episode, Podcast, Result
+    from schemas.encoding import dumps, mongo_document
+
+    podcast = Podcast.model_validate(document)
+    episodes = document["episodes"]
+    comments = [comment for episode in episodes for comment in episode["comments"]]
+    episode_models = podcast.episodes
+    return {
+        "Podcast.model_validate": lambda: Podcast.model_validate(document),
+        "Podcast.model_dump": lambda: podcast.model_dump(),
+        "Podcast.model_dump(exclude_defaults)": lambda: podcast.model_dump(exclude_defaults=True),
+        "Podcast.model_dump_json": lambda: podcast.model_dump_json(),
+        "Episode.model_validate (each)": lambda: [Episode.model_validate(episode) for episode in episodes],
+        "Episode.model_dump (each)": lambda: [episode.model_dump() for episode in episode_models],
+        "CommentStruct.model_validate (each)": lambda: [CommentStruct.model_validate(c) for c in comments],
+        "raw: encoding.dumps(mongo_document)": lambda: dumps(mongo_document(dict(document))),
+        "Result.__init__": lambda: Result(True, podcast=document),
+        "Result.model_dump": lambda: Result(True, podcast=document).model_dump(),
+    }
+
+
+def run(episode_sizes, min_time:float) -> dict:
+    benchmarks = {}
+    for episodes in episode_sizes:
+        document = podcast_document(episodes)
+        for name, func in cases(document).items():
+            key = f"{name} [episodes={episodes}]"
+            seconds = measure(func, min_time)
+            items = episodes * (1 + COMMENTS)
+            benchmarks[key] = {
+                "name": name, "episodes": episodes,
+                "ms": round(seconds * 1000, 4),
+                "us_per_item": round(seconds * 1e6 / max(items, 1), 4),
+            }
+            print(f"{key:<90} {benchmarks[key]['ms']:>12.3f} ms", file=sys.stderr)
+    _add_scaling(benchmarks)
+    return benchmarks
+
+
+def _add_scaling(benchmarks:dict):
+    """Adds the growth exponent of each benchmark over the previous episode count
+    (1 is linear, 2 quadratic)
+    """
+    by_name = {}
+    for key, result in benchmarks.items():
+        by_name.setdefault(result["name"], []).append(result)
+    for results in by_name.values():
+        results.sort(key=lambda result: result["episodes"])
+        for previous, current in zip(results, results[1:]):
+            if previous["ms"] > 0:
+                current["scaling"] = round(
+                    math.log(current["ms"] / previous["ms"]) / math.log(current["episodes"] / previous["episodes"]), 2
+                )
+
+
+def _git_revision() -> str|None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def append_history(result:dict, path:str) -> dict|None:
+    """Appends the run to the history file, returns the previous run (if any)"""
+    previous = None
+    if os.path.exists(path):
+        with open(path) as file:
+            lines = [line for line in file if line.strip()]
+        if lines:
+            previous = json.loads(lines[-1])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as file:
+        file.write(json.dumps(result) + "\n")
+    return previous
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--quick", action="store_true", help="small sizes only")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds each benchmark is repeated for")
+    parser.add_argument("--history", default=DEFAULT_HISTORY, help="JSON lines file runs are appended to")
+    parser.add_argument("--no-history", action="store_true")
+    parser.add_argument("--output", help="report path (stdout if not given)")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change counted as regression")
+    args = parser.parse_args(argv)
+
+    # `schemas` reads the settings on import, no server is used
+    for name, value in (("MONGODB_URL", "mongodb://unused"), ("REDIS_URL", "redis://unused"), ("REDIS_KEY_TTL", "1")):
+        os.environ.setdefault(name, value)
+    episode_sizes = QUICK_EPISODES if args.quick else EPISODES
+    result = {
+        "suite": "schemas",
+        "revision": _git_revision(),
+        "environment": report.environment(),
+        "config": {"episodes": episode_sizes, "comments": COMMENTS},
+        "benchmarks": run(episode_sizes, args.min_time),
+    }
+    report.dump(result, args.output)
+
+    cliffs = [key for key,value in result["benchmarks"].items() if value.get("scaling", 0) > 1.5]
+    for key in cliffs:
+        print(f"SUPERLINEAR: {key} (scaling {result['benchmarks'][key]['scaling']})", file=sys.stderr)
+    if not args.no_history:
+        previous = append_history(result, args.history)
+        if previous is not None:
+            print(f"compared with run of {previous['environment']['timestamp']} ({previous.get('revision')}):", file=sys.stderr)
+            report.print_comparison(report.compare(result, previous, args.threshold))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
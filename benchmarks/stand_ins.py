@@ -0,0 +1,83 @@
+"""Local stand-ins of the backends of the service
+
+Must be installed before any module of the service is imported, as the database and
+Redis clients are created on import.
+"""
+import os
+
+import httpx
+
+
+
+CATALOG_URL = "http://catalog.local"
+
+
+def install(mongodb_url:str|None=None, redis_url:str|None=None):
+    """Points the service to the given servers, or to in-memory fakes when not given
+
+    Args:
+    -----
+    - mongodb_url `(str|None)`: _url of a (local) `mongod`. `mongomock-motor` is used if not given_
+    - redis_url `(str|None)`: _url of a (local) redis server. `fakeredis` is used if not given_
+
+    Returns:
+    --------
+    `dict`: description of the used stand-ins (for the report)
+    """
+    os.environ.setdefault("REDIS_KEY_TTL", "3600")
+    os.environ.setdefault("SYNC_INTERVAL", "0")   # syncs are run by the benchmark itself
+    os.environ["PODCASTS_URL"] = CATALOG_URL
+    os.environ["MONGODB_URL"] = mongodb_url or "mongodb://in-memory"
+    os.environ["REDIS_URL"] = redis_url or "redis://in-memory"
+
+    if mongodb_url is None:
+        import motor.motor_asyncio
+        from mongomock_motor import AsyncMongoMockClient
+        motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+        os.environ.setdefault("MONGODB_TRANSACTIONS", "false")
+
+    if redis_url is None:
+        import fakeredis
+        import redis.asyncio
+        server = fakeredis.FakeServer()
+        # every `RedisService` gets its own client (and pool) of the same fake server
+        redis.asyncio.from_url = lambda url=None, **kwargs: fakeredis.FakeAsyncRedis(server=server, **kwargs)
+
+    return {"mongodb": mongodb_url or "mongomock-motor", "redis": redis_url or "fakeredis"}
+
+
+
+def episode_id(podcast_id:int, index:int) -> int:
+    return podcast_id * 10_000 + index
+
+
+def catalog_transport(podcasts:int, episodes:int) -> httpx.MockTransport:
+    """Transport serving a synthetic catalog of `podcasts` podcasts with `episodes` episodes each"""
+    podcast_list = [
+        {"id": podcast_id, "title": f"podcast {podcast_id}", "category": f"category {podcast_id % 10}"}
+        for podcast_id in range(1, podcasts + 1)
+    ]
+    podcast_by_id = {podcast["id"]: podcast for podcast in podcast_list}
+
+    def episode(podcast_id, index):
+        return {
+            "id": episode_id(podcast_id, index),
+            "title": f"episode {index} of {podcast_id}",
+            "duration": 60 + index,
+            "published": f"2024-01-01T00:{index % 60:02}:00",
+        }
+
+    def handler(request:httpx.Request) -> httpx.Response:
+        parts = request.url.path.strip("/").split("/")
+        if parts == ["podcasts"]:
+            return httpx.Response(200, json=podcast_list)
+        podcast_id = int(parts[1])
+        if podcast_id not in podcast_by_id:
+            return httpx.Response(404, json={"detail": "not found"})
+        if len(parts) == 2:
+            return httpx.Response(200, json=podcast_by_id[podcast_id])
+        if len(parts) == 3:
+            return httpx.Response(200, json=[episode(podcast_id, index) for index in range(episodes)])
+        return httpx.Response(200, json=episode(podcast_id, int(parts[3]) % 10_000))
+
+    return httpx.MockTransport(handler)
@@ -0,0 +1,44 @@
+import time
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from services.metrics import metrics, request_errors, request_latency
+
+
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics_api():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and 5xx errors of every request by route template"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # the router puts the matched route in scope (templated path keeps label count bounded)
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            request_latency.observe(time.perf_counter() - started, scope["method"], path, status)
+            if status >= 500:
+                request_errors.inc(scope["method"], path)
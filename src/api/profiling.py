@@ -0,0 +1,130 @@
+import cProfile
+import io
+import pstats
+import time
+from uuid import uuid4
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+
+from auth import JWTHandler
+from config import SETTINGS
+from schemas import JWTPayload
+from schemas.encoding import dumps, loads
+from services import RedisService
+from services.metrics import IOBreakdown, io_breakdown
+from .responses import MongoJSONResponse
+
+
+
+jwt_handler = JWTHandler()
+profiles_redis = RedisService()
+
+STATS_LINES = 60  # functions kept of each profile (sorted by cumulative time)
+
+
+def _profile_key(profile_id:str) -> str:
+    return f"profile:{profile_id}"
+
+
+async def admin(request:Request) -> JWTPayload:
+    """Authenticates the request with `JWTHandler` and checks the user is an admin
+
+    Raises:
+    -------
+    HTTPException: `403` when the user is not in `SETTINGS.PROFILE_ADMIN_IDS`
+    """
+    jwt = await jwt_handler.authenticate(request)
+    if str(jwt.id) not in SETTINGS.PROFILE_ADMIN_IDS:
+        raise HTTPException(403, "Not allowed")
+    return jwt
+
+
+
+class ProfilingMiddleware:
+    """Profiles single requests of admins that carry the `SETTINGS.PROFILE_HEADER` header
+
+    The request is run under `cProfile` and the time it waited for Mongo, Redis, the
+    catalog and auth is collected (through `services.metrics.observe`). The result is kept
+    in Redis for `SETTINGS.PROFILE_TTL` seconds under the id returned in the
+    `X-Profile-Id` response header, see `GET /admin/profiles/{id}`.
+
+    `cProfile` traces the whole thread, so other requests served by this worker at the
+    same time show up in the call stats (the I/O breakdown is per request). Only one
+    request is profiled at a time; requests without the header cost a header lookup.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.header = SETTINGS.PROFILE_HEADER.lower().encode()
+        self._active = False
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http") or not any(name == self.header for name,_ in scope["headers"]):
+            return await self.app(scope, receive, send)
+        try:
+            await admin(Request(scope))
+        except HTTPException:
+            # served as usual, the header is not acknowledged to non-admins
+            return await self.app(scope, receive, send)
+        if self._active:
+            return await self.app(scope, receive, send)
+        await self._profile(scope, receive, send)
+
+    async def _profile(self, scope, receive, send):
+        profile_id = uuid4().hex
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        profiler = cProfile.Profile()
+        breakdown = IOBreakdown()
+        token = io_breakdown.set(breakdown)
+        self._active = True
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profiler.disable()
+            duration = time.perf_counter() - started
+            self._active = False
+            io_breakdown.reset(token)
+            await self._save(profile_id, scope, status, duration, profiler, breakdown)
+
+    async def _save(self, profile_id, scope, status, duration, profiler, breakdown:IOBreakdown):
+        stats_text = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stats_text)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(STATS_LINES)
+        io_summary = breakdown.summary()
+        waited = sum(backend["seconds"] for name,backend in io_summary["backends"].items() if name != "auth")
+        profile = {
+            "id": profile_id,
+            "method": scope["method"],
+            "path": scope["path"],
+            "query": scope["query_string"].decode(),
+            "status": status,
+            "created_at": time.time(),
+            "duration": duration,
+            "profiled": stats.total_tt,  # time spent running python code (not awaiting)
+            # auth is excluded from the total as its own redis lookups are counted as well
+            "io_wait": waited,
+            "io": io_summary,
+            "stats": stats_text.getvalue(),
+        }
+        await profiles_redis.set(_profile_key(profile_id), dumps(profile), ttl=SETTINGS.PROFILE_TTL)
+
+
+
+router = APIRouter(prefix="/admin")
+
+
+@router.get("/profiles/{profile_id}", include_in_schema=False)
+async def profile_api(profile_id:str, _:JWTPayload=Depends(admin)):
+    profile = await profiles_redis.get(_profile_key(profile_id))
+    if profile is None:
+        raise HTTPException(404, "Profile not found (or expired)")
+    return MongoJSONResponse(loads(profile))
@@ -0,0 +1,13 @@
+from fastapi.responses import JSONResponse
+
+from schemas.encoding import dumps
+
+
+
+class MongoJSONResponse(JSONResponse):
+    """JSON response of raw Motor documents, serialized with orjson
+
+    Returning it from an endpoint also skips `jsonable_encoder` of FastAPI.
+    """
+    def render(self, content) -> bytes:
+        return dumps(content)
@@ -1,90 +1,192 @@
 from bson import ObjectId
-import bson.errors
 
-from fastapi import APIRouter, Depends, HTTPException,status
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, HTTPException, Query,status
+from fastapi.responses import JSONResponse, StreamingResponse
 
 from auth import JWTHandler
-from db import db
+from config import SETTINGS
 from db.podcasts import (
+    find_podcasts,
     get_podcast_details,
     get_podcast_episode_details,
-    # get_podcast_episode_list,
+    get_podcast_episode_list,
     get_podcast_list,
+    is_episode_liked,
     like_episode,
     subscribe_podcast,
     unlike_episode,
     unsubscribe_podcast,
-    update_db,
 )
-from schemas import JWTPayload, Podcast,Result
+from db.feed import get_feed
+from db.interactions import apply_interactions
+from db.likes import get_episode_likers
+from db.scheduler import sync_scheduler
+from db.subscriptions import get_podcast_subscribers, get_user_subscriptions
+from schemas import InteractionBatch, JWTPayload, Result
+from schemas.encoding import dumps, mongo_document
+from ..responses import MongoJSONResponse
+from .conditional import episode_version, podcast_list_version, podcast_version
+from .pagination import PageParams, encode_cursor
+from .validators import validate_id
 
 
 
-router = APIRouter(prefix='/v1')
+router = APIRouter(prefix='/v1', default_response_class=MongoJSONResponse)
 
 jwt_object = JWTHandler()
 
 
 
 
-def validate_id(id:str):
-    try:
-        return ObjectId(id)
-    except bson.errors.InvalidId:
-        raise HTTPException(404, "Not found")
 
 
 @router.get("/podcasts")
-async def podcast_list():
-    res = await db["podcasts"].find(projection={"episodes":0,"subscribers":0}).to_list(100)
-    if res:
-        return list(map(
-            lambda item: item.model_dump(exclude_defaults=True), map(Podcast.model_validate, res)
-        ))
-    return {"msg":"not podcast found"}
+async def podcast_list(
+    page:PageParams=Depends(), stream:bool=False, cache_headers:dict=Depends(podcast_list_version)
+):
+    """Keyset paginated podcast list: `{"items": [...], "next": <cursor of next page>}`
+
+    With `stream`, items are written to the response while they are read from db.
+    """
+    # one extra podcast is read to know if there is a next page
+    cursor = find_podcasts(page.after, page.limit + 1)
+    if stream:
+        return StreamingResponse(
+            _stream_podcasts(cursor, page.limit), media_type="application/json", headers=cache_headers
+        )
+    podcasts = await cursor.to_list(page.limit + 1)
+    next_cursor = encode_cursor(podcasts[page.limit-1]["_id"]) if len(podcasts) > page.limit else None
+    return MongoJSONResponse(
+        {"items": list(map(mongo_document, podcasts[:page.limit])), "next": next_cursor}, headers=cache_headers
+    )
+
+
+async def _stream_podcasts(cursor, limit:int):
+    yield b'{"items":['
+    count = 0
+    next_cursor = last_id = None
+    async for podcast in cursor:
+        if count == limit:
+            next_cursor = encode_cursor(last_id)
+            break
+        last_id = podcast["_id"]
+        yield (b"," if count else b"") + dumps(mongo_document(podcast))
+        count += 1
+    yield b'],"next":' + dumps(next_cursor) + b"}"
 
 
 @router.get("/podcast/{id}")
-async def podcast_details(id:str=Depends(validate_id)):
+async def podcast_details(id:str=Depends(validate_id), cache_headers:dict=Depends(podcast_version)):
     res = await get_podcast_details(id)
-    return res or {"msg":"no podcast with this id found"}
-
-
-# @router.get("/podcast/{id}/episodes")
-# async def podcast_episodes(id):
-#     res = await get_podcast_episode_list(id)
-#     return res or {"msg":"no episodes found"}
+    if not res:
+        return MongoJSONResponse({"msg":"no podcast with this id found"})
+    return MongoJSONResponse(res, headers=cache_headers)
+
+
+@router.get("/podcast/{id}/episodes")
+async def podcast_episodes(
+    id:str=Depends(validate_id),
+    offset:int=Query(0, ge=0),
+    limit:int=Query(SETTINGS.PAGE_SIZE, ge=1, le=SETTINGS.PAGE_MAX_SIZE),
+    cache_headers:dict=Depends(podcast_version),
+):
+    res = await get_podcast_episode_list(id, offset, limit)
+    if not res:
+        return MongoJSONResponse({"msg":"no episodes found"})
+    return MongoJSONResponse(res, headers=cache_headers)
 
 @router.get("/podcast/{podcast_id}/episode/{episode_id}")
-async def podcast_episode_detail(podcast_id:str, episode_id:str):
+async def podcast_episode_detail(podcast_id:str, episode_id:str, cache_headers:dict=Depends(episode_version)):
     res = await get_podcast_episode_details(ObjectId(podcast_id), ObjectId(episode_id))
-    return res or {"msg": "no episode with this id has been found"}
+    if not res:
+        return MongoJSONResponse({"msg": "no episode with this id has been found"})
+    return MongoJSONResponse(res, headers=cache_headers)
+
+
+
+@router.get("/podcast/{podcast_id}/episode/{episode_id}/likes")
+async def podcast_episode_likes(
+    episode_id:str, podcast_id:str, page:PageParams=Depends()
+):
+    podcast_id = validate_id(podcast_id)
+    likes, next_id = await get_episode_likers(podcast_id, episode_id, page.after, page.limit)
+    return MongoJSONResponse({"items": likes, "next": next_id and encode_cursor(next_id)})
 
 
 
+@router.get("/podcast/{podcast_id}/episode/{episode_id}/like")
+async def episode_like_state(
+    episode_id:str, podcast_id:str, jwt:JWTPayload=Depends(jwt_object)
+):
+    podcast_id = validate_id(podcast_id)
+    return {"liked": await is_episode_liked(podcast_id, episode_id, jwt.id)}
+
+
 @router.post("/podcast/{podcast_id}/episode/{episode_id}/like")
-async def like_episode_api(podcast_id, episode_id, jwt:JWTPayload=Depends(jwt_object)):
+async def like_episode_api(
+    episode_id:str, podcast_id:str, jwt:JWTPayload=Depends(jwt_object)
+):
+    podcast_id = validate_id(podcast_id)
     res = await like_episode(podcast_id,episode_id, jwt.id)
     return JSONResponse(Result().model_dump(), 201 if res else 208)
 
 
 @router.post("/podcast/{podcast_id}/episode/{episode_id}/unlike")
-async def unlike_episode_api(podcast_id, episode_id, jwt:JWTPayload=Depends(jwt_object)):
+async def unlike_episode_api(
+    episode_id:str, podcast_id:str, jwt:JWTPayload=Depends(jwt_object)
+):
+    podcast_id = validate_id(podcast_id)
     res = await unlike_episode(podcast_id, episode_id, jwt.id)
     return JSONResponse(Result().model_dump(), 201 if res else 208)
 
 
 
 @router.post("/podcast/{podcast_id}/subscribe/")
-async def subscribe_podcast_api(podcast_id, jwt:JWTPayload=Depends(jwt_object)):
+async def subscribe_podcast_api(podcast_id:str, jwt:JWTPayload=Depends(jwt_object)):
+    podcast_id = validate_id(podcast_id)
     res = await subscribe_podcast(podcast_id, jwt.id)
-    return {"msg":"ok"}
+    return JSONResponse(Result().model_dump(), 201 if res else 208)
 
 @router.post("/podcast/{podcast_id}/unsubscribe/")
-async def unsubscribe_podcast_api(podcast_id, jwt:JWTPayload=Depends(jwt_object)):
-    res = await unsubscribe_podcast(ObjectId(podcast_id), ObjectId(jwt.id))
-    return {"msg":"ok"}
+async def unsubscribe_podcast_api(podcast_id:str, jwt:JWTPayload=Depends(jwt_object)):
+    podcast_id = validate_id(podcast_id)
+    res = await unsubscribe_podcast(podcast_id, jwt.id)
+    return JSONResponse(Result().model_dump(), 201 if res else 208)
+
+
+@router.get("/podcast/{podcast_id}/subscribers")
+async def podcast_subscribers(podcast_id:str, page:PageParams=Depends()):
+    podcast_id = validate_id(podcast_id)
+    subscriptions, next_id = await get_podcast_subscribers(podcast_id, page.after, page.limit)
+    return MongoJSONResponse({"items": subscriptions, "next": next_id and encode_cursor(next_id)})
+
+
+@router.get("/subscriptions")
+async def user_subscriptions(page:PageParams=Depends(), jwt:JWTPayload=Depends(jwt_object)):
+    """Keyset paginated podcasts the user is subscribed to"""
+    subscriptions, next_id = await get_user_subscriptions(jwt.id, page.after, page.limit)
+    return MongoJSONResponse({"items": subscriptions, "next": next_id and encode_cursor(next_id)})
+
+
+@router.get("/feed")
+async def user_feed(
+    offset:int=Query(0, ge=0),
+    limit:int=Query(SETTINGS.PAGE_SIZE, ge=1, le=SETTINGS.PAGE_MAX_SIZE),
+    jwt:JWTPayload=Depends(jwt_object),
+):
+    """Newest episodes of the podcasts the user is subscribed to: `{"items": [...], "next": <offset>}`"""
+    return MongoJSONResponse(await get_feed(jwt.id, offset, limit))
+
+
+
+@router.post("/interactions:batch")
+async def interactions_batch_api(batch:InteractionBatch, jwt:JWTPayload=Depends(jwt_object)):
+    """Applies like/unlike/subscribe/unsubscribe operations (e.g. synced offline actions) in order
+
+    Returns `{"results": [...]}` with the status (201/208/404) of each operation.
+    """
+    results = await apply_interactions(jwt.id, batch.operations)
+    return {"results": [result.model_dump(exclude_none=True) for result in results]}
 
 
 
@@ -92,7 +194,18 @@ async def unsubscribe_podcast_api(podcast_id, jwt:JWTPayload=Depends(jwt_object)
 async def update_db_api(): #jwt:JWTPayload=Depends(jwt_object)
     # check if user has permission to do this
 
-    # call `update_db` function
-    await update_db()
+    job_id = await sync_scheduler.enqueue()
+    return JSONResponse(Result(True, job_id=job_id).model_dump(), 202)
+
 
-    return Result().model_dump()
+@router.get("/update/")
+async def update_db_status_api():
+    return Result(True, **await sync_scheduler.status()).model_dump()
+
+
+@router.get("/update/{job_id}")
+async def update_db_job_api(job_id:str):
+    job = await sync_scheduler.job(job_id)
+    if job is None:
+        raise HTTPException(404, "Not found")
+    return Result(True, **job).model_dump()
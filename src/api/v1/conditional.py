@@ -0,0 +1,36 @@
+from fastapi import Depends, HTTPException, Request
+
+from config import SETTINGS
+from db.podcasts import PODCAST_LIST_VERSION, cache, podcast_cache_tag
+from .validators import validate_id
+
+
+
+async def check_version(request:Request, name:str) -> dict:
+    """Caching headers (`ETag`, `Cache-Control`) of the current version of a resource
+
+    Raises:
+    -------
+    HTTPException: `304` if `If-None-Match` of the request matches the current version
+    """
+    # read before the resource itself, so a concurrent write can only make the ETag older
+    # than the data (the next request gets a 200), never newer: invalidations bump the
+    # version again once the cached entries are dropped (see `CacheService.invalidate_tags`)
+    etag = f'"{await cache.version(name)}"'
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={SETTINGS.HTTP_CACHE_MAX_AGE}, must-revalidate"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        if etag in tags or "*" in tags:
+            raise HTTPException(304, headers=headers)
+    return headers
+
+
+async def podcast_list_version(request:Request) -> dict:
+    return await check_version(request, PODCAST_LIST_VERSION)
+
+async def podcast_version(request:Request, id=Depends(validate_id)) -> dict:
+    return await check_version(request, podcast_cache_tag(id))
+
+async def episode_version(request:Request, podcast_id:str) -> dict:
+    return await check_version(request, podcast_cache_tag(validate_id(podcast_id)))
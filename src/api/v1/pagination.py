@@ -0,0 +1,43 @@
+import base64
+import binascii
+
+import bson.errors
+from bson import ObjectId
+from fastapi import HTTPException, Query
+
+from config import SETTINGS
+
+
+
+def encode_cursor(id:ObjectId) -> str:
+    """Opaque cursor of a keyset page (the last `_id` of the page)"""
+    return base64.urlsafe_b64encode(id.binary).decode().rstrip("=")
+
+
+def decode_cursor(cursor:str) -> ObjectId:
+    try:
+        return ObjectId(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, TypeError, ValueError, bson.errors.InvalidId):
+        raise HTTPException(400, "Invalid cursor")
+
+
+class PageParams:
+    """Keyset pagination query parameters (`limit` and `after` cursor)
+
+    Usage:
+    ------
+    ```python
+    @router.get("/items")
+    async def items(page:PageParams=Depends()):
+        # one extra item is read to know if there is a next page
+        ...  # find({"_id": {"$gt": page.after}}).sort("_id", 1).limit(page.limit + 1)
+    ```
+    """
+    def __init__(
+        self,
+        limit : int = Query(SETTINGS.PAGE_SIZE, ge=1, le=SETTINGS.PAGE_MAX_SIZE),
+        after : str|None = Query(None, description="`next` cursor of the previous page"),
+    ):
+        self.limit = limit
+        self.after = decode_cursor(after) if after else None
+
@@ -0,0 +1,12 @@
+from bson import ObjectId
+import bson.errors
+
+from fastapi import HTTPException
+
+
+
+def validate_id(id:str):
+    try:
+        return ObjectId(id)
+    except bson.errors.InvalidId:
+        raise HTTPException(404, "Not found")
@@ -1 +1 @@
-from .jwt_auth import JWTHandler
\ No newline at end of file
+from .jwt_auth import JWTHandler, SessionCache, session_cache
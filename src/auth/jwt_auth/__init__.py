@@ -1 +1,2 @@
 from .jwt_auth import JWTHandler
+from .session_cache import SessionCache, session_cache
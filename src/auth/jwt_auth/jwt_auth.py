@@ -3,7 +3,7 @@ from fastapi import Request,HTTPException
 import jwt
 
 from schemas import Result,JWTPayload
-from services import RedisService
+from services import RedisService, observed
 from .utils import (
     decode_jwt,
     _generate_access_token,
@@ -12,6 +12,7 @@ from .utils import (
     encode_payload,
 )
 from .exceptions import PermissionDenied
+from .session_cache import session_cache
 
 
 
@@ -37,7 +38,9 @@ class JWTHandler:
     def __init__(self):
         self.jwt_auth = JWTAuth()
         self.auth_cache = RedisService()
+        self.session_cache = session_cache
 
+    @observed("auth", "jwt")
     async def authenticate(self, request:Request) -> JWTPayload:
         """Main method of this class which is responsible to authenticate users with their access token
 
@@ -60,11 +63,15 @@ class JWTHandler:
     __call__ = authenticate
 
     async def _validate_cache_data(self, id, jti, user_agent):
-        user_redis_jti = await self.auth_cache.get(f"{id}|{jti}")
+        key = f"{id}|{jti}"
+        if self.session_cache.get(key, user_agent):
+            return
+        user_redis_jti = await self.auth_cache.get(key)
         if user_redis_jti is None:
             raise PermissionDenied('Not Found in cache, login again.')
         if user_redis_jti != user_agent:
             raise PermissionDenied('Invalid refresh token, please login again.')
+        self.session_cache.add(key, user_agent)
 
 
 
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from config import SETTINGS
+from services import RedisService
+from services.metrics import cache_requests
+
+
+
+logger = logging.getLogger(__name__)
+
+
+class SessionCache:
+    """Bounded in-process LRU cache of sessions already validated against Redis
+
+    Entries map the session key (`{user_id}|{jti}`) to its user agent and live at most
+    `ttl` seconds, which is the longest a revoked session may still be accepted by this
+    replica if a revocation message is lost.
+
+    Revocations are pushed to every replica through the `channel` pub/sub channel (the
+    message is the session key, or `{user_id}|*` for all sessions of a user). If Redis
+    keyspace notifications are enabled, deleting/expiring a session key evicts it as well.
+
+    Usage:
+    ------
+    ```python
+    session_cache = SessionCache()
+    await session_cache.start()   # on app startup
+
+    if not session_cache.get(key, user_agent):
+        ...  # validate with redis
+        session_cache.add(key, user_agent)
+
+    await session_cache.revoke(user_id, jti)   # logout
+    ```
+    """
+    reconnect_delay = 1  # seconds to wait before subscribing again after connection loss
+
+    def __init__(self, redis:RedisService=None, maxsize:int=None, ttl:float=None, channel:str=None):
+        self.redis = redis or RedisService()
+        self.maxsize = maxsize or SETTINGS.AUTH_SESSION_CACHE_SIZE
+        self.ttl = ttl if ttl is not None else SETTINGS.AUTH_SESSION_CACHE_TTL
+        self.channel = channel or SETTINGS.AUTH_REVOKE_CHANNEL
+        self._entries : OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._listener : asyncio.Task|None = None
+
+
+    def get(self, key:str, user_agent:str) -> bool:
+        """Checks if the session is cached (and not expired) for the given user agent"""
+        entry = self._entries.get(key)
+        if entry is None:
+            cache_requests.inc("session", "miss")
+            return False
+        cached_agent, expires_at = entry
+        if expires_at < time.monotonic():
+            self._entries.pop(key, None)
+            cache_requests.inc("session", "miss")
+            return False
+        self._entries.move_to_end(key)
+        cache_requests.inc("session", "hit")
+        return cached_agent == user_agent
+
+    def add(self, key:str, user_agent:str):
+        if not self.ttl:
+            return
+        self._entries[key] = (user_agent, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def evict(self, key:str):
+        """Removes a session (or all sessions of a user when key is `{user_id}|*`)"""
+        if key.endswith("|*"):
+            prefix = key[:-1]
+            for cached_key in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[cached_key]
+        else:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+
+    async def revoke(self, user_id:str, jti:str|None=None):
+        """Deletes the session(s) from Redis and notifies every replica
+
+        Args:
+        -----
+        - user_id `(str)`: _identifier of the user_
+        - jti `(str|None)`: _session to revoke. all sessions of the user if not given_
+        """
+        if jti is None:
+            keys = await self.redis.keys(f"{user_id}|*")
+            if keys:
+                await self.redis.delete(*keys)
+            key = f"{user_id}|*"
+        else:
+            key = f"{user_id}|{jti}"
+            await self.redis.delete(key)
+        self.evict(key)
+        await self.redis.publish(self.channel, key)
+
+
+    async def start(self):
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        self.clear()
+
+    async def _listen(self):
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                await pubsub.psubscribe("__keyspace@*__:*|*")
+                async for message in pubsub.listen():
+                    self._handle(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("session revocation listener disconnected")
+                # revocations may have been missed while disconnected
+                self.clear()
+                await asyncio.sleep(self.reconnect_delay)
+            finally:
+                await pubsub.close()
+
+    def _handle(self, message:dict):
+        data = message["data"]
+        if isinstance(data, bytes):
+            data = data.decode()
+        if message["type"] == "message":
+            self.evict(data)
+        elif message["type"] == "pmessage":
+            channel = message["channel"]
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            # channel is `__keyspace@<db>__:<key>` and data is the event name (del, expired, ...)
+            self.evict(channel.split("__:", 1)[1])
+
+
+session_cache = SessionCache()
@@ -5,11 +5,67 @@ from pydantic_settings import BaseSettings
 
 class _Config(BaseSettings):
     MONGODB_URL : str
+    MONGODB_TRANSACTIONS : bool = False  # write edges with their counters in transactions (needs a replica set, slower)
 
     REDIS_URL : str
     REDIS_KEY_TTL : int
 
+    AUTH_SESSION_CACHE_SIZE : int = 10000
+    AUTH_SESSION_CACHE_TTL : float = 5
+    AUTH_REVOKE_CHANNEL : str = "auth:revoked"
+
+    PAGE_SIZE : int = 50
+    PAGE_MAX_SIZE : int = 500
+
+    PROFILE_HEADER : str = "X-Profile"       # requests with it (from admins) are profiled
+    PROFILE_ADMIN_IDS : list[str] = []       # user identifiers allowed to profile requests
+    PROFILE_TTL : int = 3600                 # seconds profiles are kept
+
+    HTTP_CACHE_MAX_AGE : int = 0   # seconds clients may reuse a versioned response without revalidating
+
     PODCASTS_URL : str = ""
+    PODCASTS_MAX_CONNECTIONS : int = 100
+    PODCASTS_MAX_KEEPALIVE : int = 20
+    PODCASTS_KEEPALIVE_EXPIRY : float = 30
+    PODCASTS_HTTP2 : bool = False
+    PODCASTS_TIMEOUT : float = 5
+    PODCASTS_CONNECT_TIMEOUT : float = 2
+    PODCASTS_CACHE_SIZE : int = 10000       # catalog responses cached in process
+    PODCASTS_LIST_TTL : float = 30          # seconds each catalog response is fresh (0 disables caching it)
+    PODCASTS_DETAILS_TTL : float = 300
+    PODCASTS_EPISODES_TTL : float = 60
+    PODCASTS_EPISODE_TTL : float = 300
+    PODCASTS_STALE_TTL : float = 600        # seconds an expired response is still served while it is refreshed
+    PODCASTS_BATCH_PATH : str = ""          # batch details endpoint of the catalog (`POST {"ids": [...]}`), if it has one
+    PODCASTS_BATCH_SIZE : int = 100         # max podcasts of one batched details lookup
+    PODCASTS_BATCH_WINDOW : float = 0       # seconds lookups are collected for (0: one event loop iteration)
+    PODCASTS_BATCH_CONCURRENCY : int = 16   # concurrent details requests of a batch without batch endpoint
+    PODCASTS_HEDGE_PERCENTILE : float = 95  # latency percentile after which a GET is sent again (0 disables hedging)
+    PODCASTS_HEDGE_WINDOW : int = 200       # latest request latencies the percentile is taken from
+    PODCASTS_HEDGE_BUDGET : float = 0.1     # max ratio of GETs that are hedged (so a slow catalog is not sent twice the load)
+    PODCASTS_BREAKER_ERROR_RATE : float = 0.5   # failure rate of latest requests that opens the circuit (0 disables it)
+    PODCASTS_BREAKER_WINDOW : int = 50
+    PODCASTS_BREAKER_MIN_CALLS : int = 20
+    PODCASTS_BREAKER_COOLDOWN : float = 30      # seconds requests fail fast before a probe request is let through
+
+    SYNC_CONCURRENCY : int = 16
+    SYNC_BATCH_SIZE : int = 500
+    SYNC_QUERY_CHUNK_SIZE : int = 1000
+    SYNC_INTERVAL : int = 3600       # seconds between scheduled syncs (0 disables them)
+    SYNC_POLL_INTERVAL : float = 5   # seconds between checks for queued/due syncs
+    SYNC_LOCK_TTL : int = 60
+    SYNC_MAX_DURATION : float = 1800  # seconds after which a sync is cancelled (and the lock released)
+
+    LIKES_WRITE_BEHIND : bool = False   # buffer like/unlike intents in Redis, written by a flusher
+    LIKES_FLUSH_INTERVAL : float = 1    # seconds between flushes
+    LIKES_FLUSH_SIZE : int = 1000       # intents recorded by a replica that trigger an early flush (also max operations per bulk write)
+    LIKES_FLUSH_LOCK_TTL : int = 30
+
+    INTERACTIONS_BATCH_SIZE : int = 100   # max operations of `POST /v1/interactions:batch`
+
+    FEED_MAX_PODCASTS : int = 500   # newest subscriptions of a user merged into their feed
+    FEED_CONCURRENCY : int = 16     # catalog requests in flight while building one feed
+    FEED_CACHE_TTL : int = 60       # seconds a feed page is cached (like counts of its episodes may be that old)
 
     # REDIX : _RedisConfig
 
@@ -1,7 +1,106 @@
+import asyncio
+from typing import Awaitable, Callable, TypeVar
+
 import motor.motor_asyncio
+from pymongo import DeleteOne, UpdateOne
+from pymongo.errors import BulkWriteError
 
 from config import SETTINGS
+from services.metrics import MongoListener
 
 
-client = motor.motor_asyncio.AsyncIOMotorClient(SETTINGS.MONGODB_URL)
+client = motor.motor_asyncio.AsyncIOMotorClient(SETTINGS.MONGODB_URL, event_listeners=[MongoListener()])
 db = client["podcasts"]
+
+T = TypeVar("T")
+
+
+
+class Rollback(Exception):
+    """Raised by an operation of `run_transaction` to undo its writes"""
+
+
+_supports_transactions : bool|None = None if SETTINGS.MONGODB_TRANSACTIONS else False
+
+async def supports_transactions() -> bool:
+    """Transactions are opt-in (`SETTINGS.MONGODB_TRANSACTIONS`), as they take more round
+    trips than concurrent writes, and need a replica set or a sharded cluster
+    """
+    global _supports_transactions
+    if _supports_transactions is None:
+        hello = await client.admin.command("hello")
+        _supports_transactions = ("setName" in hello) or (hello.get("msg") == "isdbgrid")
+    return _supports_transactions
+
+
+async def run_transaction(operation:Callable[..., Awaitable[T]]) -> T:
+    """Runs `operation(session)` in a transaction if they are enabled and supported
+    (`session` is `None` otherwise) and returns its result
+
+    The transaction commits when `operation` returns and aborts when it raises.
+    `operation` is run again on `TransientTransactionError` (and the commit is retried on
+    `UnknownTransactionCommitResult`), so it must not have other side effects.
+
+    Usage:
+    ------
+    ```python
+    async def operation(session):
+        return await run_writes(
+            lambda session: db["a"].update_one(..., session=session),
+            lambda session: db["b"].update_one(..., session=session),
+            session=session,
+        )
+
+    results = await run_transaction(operation)
+    ```
+    """
+    if not await supports_transactions():
+        return await operation(None)
+    async with await client.start_session() as session:
+        return await session.with_transaction(operation)
+
+
+async def run_writes(*writes:Callable[..., Awaitable], session=None) -> list:
+    """Runs independent writes, concurrently or (as a session can not be shared by
+    concurrent operations) one by one inside the transaction of `session`
+    """
+    if session is None:
+        return await asyncio.gather(*(write(None) for write in writes))
+    return [await write(session) for write in writes]
+
+
+async def upsert_each(collection, operations:list[UpdateOne], session=None) -> set[int]:
+    """Runs the upserts, returns indexes of the ones that inserted a document
+
+    Without a transaction, concurrent upserts of one document may fail on the unique
+    index, the document exists then (so it is counted as not inserted).
+    """
+    if not operations:
+        return set()
+    try:
+        result = await collection.bulk_write(operations, ordered=False, session=session)
+    except BulkWriteError as e:
+        if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+            raise
+        return {upserted["index"] for upserted in e.details["upserted"]}
+    return set(result.upserted_ids)
+
+
+async def delete_each(collection, queries:list[dict], session=None) -> list[bool]:
+    """Deletes the document of each query with one bulk write, returns which ones existed
+
+    Documents are read first (within `session`), so the result is exact inside a
+    transaction. Each query must match one document at most.
+    """
+    if not queries:
+        return []
+    fields = {field: 1 for query in queries for field in query}
+    existing = await collection.find({"$or": queries}, projection=fields, session=session).to_list(None)
+    found = [
+        any(all(document.get(field) == value for field,value in query.items()) for document in existing)
+        for query in queries
+    ]
+    deletes = [DeleteOne(query) for query,exists in zip(queries, found) if exists]
+    if deletes:
+        await collection.bulk_write(deletes, ordered=False, session=session)
+    return found
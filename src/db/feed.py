@@ -0,0 +1,91 @@
+import asyncio
+import heapq
+from itertools import islice
+
+from bson import ObjectId
+from pymongo import DESCENDING
+
+from config import SETTINGS
+from .podcasts import FEED_VERSION, cache, feed_cache_tag, merge_episodes, podcast_service, podcasts_collection
+from .subscriptions import subscriptions_collection
+
+
+
+def _published(episode:dict) -> str:
+    # catalog dates are ISO 8601 strings (they sort as they compare), undated episodes go last
+    return episode.get("published") or ""
+
+
+async def get_feed(user_id:str|ObjectId, offset:int, limit:int):
+    """Page of newest episodes of the podcasts user is subscribed to
+
+    Cached per user for `SETTINGS.FEED_CACHE_TTL` seconds. Entries are dropped when user
+    (un)subscribes (see `feed_cache_tag`) and outdated when a sync changes podcasts (see
+    `FEED_VERSION`). Likes do not drop them, like counts of a page may be that old.
+    """
+    user_id = ObjectId(user_id)
+    version = await cache.version(FEED_VERSION)
+    return await cache.get_or_load(
+        f"feed:{version}:{user_id}:{offset}:{limit}",
+        lambda: _load_feed(user_id, offset, limit),
+        ttl=SETTINGS.FEED_CACHE_TTL,
+        tags=[feed_cache_tag(user_id)],
+    )
+
+
+async def _load_feed(user_id:ObjectId, offset:int, limit:int):
+    podcast_ids = [
+        subscription["podcast"] async for subscription in subscriptions_collection.find(
+            {"user": user_id}, projection={"podcast":1}
+        ).sort("_id", DESCENDING).limit(SETTINGS.FEED_MAX_PODCASTS)
+    ]
+    podcasts = await podcasts_collection.find(
+        {"_id": {"$in": podcast_ids}}, projection={"api_identifier":1}
+    ).to_list(None)
+    semaphore = asyncio.Semaphore(SETTINGS.FEED_CONCURRENCY)
+
+    async def newest_episodes(podcast:dict) -> list[dict]:
+        async with semaphore:
+            resp = await podcast_service.podcast_episode_list(podcast["api_identifier"])
+        if not resp:
+            return []
+        # only the episodes that can be on the page are sorted (and read from db)
+        return heapq.nlargest(offset + limit + 1, resp.data["episodes"], key=_published)
+
+    catalog_lists = await asyncio.gather(*map(newest_episodes, podcasts))
+    db_episodes = await _episodes_of(
+        [podcast["_id"] for podcast in podcasts],
+        [episode["id"] for episodes in catalog_lists for episode in episodes],
+    )
+    episode_lists = []
+    for podcast, catalog_episodes in zip(podcasts, catalog_lists):
+        # still newest first, episodes missing from db (not synced yet) are skipped
+        episodes = merge_episodes(db_episodes.get(podcast["_id"], []), catalog_episodes)
+        episodes.sort(key=_published, reverse=True)
+        for episode in episodes:
+            episode["podcast"] = podcast["_id"]
+        episode_lists.append(episodes)
+
+    # lazy k-way merge of the (newest first) lists, stopped right after the page
+    merged = heapq.merge(*episode_lists, key=_published, reverse=True)
+    page = list(islice(merged, offset, offset + limit + 1))
+    return {
+        "items": page[:limit],
+        "next": (offset + limit) if len(page) > limit else None,
+    }
+
+
+async def _episodes_of(podcast_ids:list[ObjectId], api_identifiers:list) -> dict[ObjectId, list[dict]]:
+    """Embedded episodes (`id`, `api_identifier`, `likes_count`) of the podcasts with the
+    given catalog identifiers, filtered by the server instead of reading whole arrays
+    """
+    if not api_identifiers:
+        return {}
+    cursor = podcasts_collection.aggregate([
+        {"$match": {"_id": {"$in": podcast_ids}}},
+        {"$project": {"episodes": {"$map": {
+            "input": {"$filter": {"input": "$episodes", "cond": {"$in": ["$$this.api_identifier", api_identifiers]}}},
+            "in": {"id": "$$this.id", "api_identifier": "$$this.api_identifier", "likes_count": "$$this.likes_count"},
+        }}}},
+    ])
+    return {podcast["_id"]: podcast["episodes"] async for podcast in cursor}
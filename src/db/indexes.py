@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import sys
+
+from bson import ObjectId
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from db import db
+from .likes import LIKE_INDEXES
+from .podcasts import get_episode_query
+from .subscriptions import SUBSCRIPTION_INDEXES
+
+
+
+logger = logging.getLogger(__name__)
+
+
+# NOTE: episode queries (`get_episode_query`) also filter on `_id`, so they do not need
+#   a (multikey) index on `episodes.id`
+INDEXES = {
+    "podcasts": [
+        IndexModel([("api_identifier", ASCENDING)], unique=True),
+    ],
+    "users": [
+        IndexModel([("api_identifier", ASCENDING)], unique=True),
+    ],
+    "likes": LIKE_INDEXES,
+    "subscriptions": SUBSCRIPTION_INDEXES,
+}
+
+
+async def ensure_indexes():
+    """Creates the declared indexes (does nothing for the ones that already exist)"""
+    for collection_name, indexes in INDEXES.items():
+        try:
+            await db[collection_name].create_indexes(indexes)
+        except OperationFailure:
+            # e.g. duplicates preventing a unique index, must not stop the app from starting
+            logger.exception("could not create indexes of `%s` collection", collection_name)
+
+
+
+def _query_shapes():
+    """Every query shape issued by `db` package as (name, collection, filter, sort)"""
+    oid = ObjectId()
+    return [
+        ("podcast by id", "podcasts", {"_id": oid}, None),
+        ("episode of podcast", "podcasts", get_episode_query(oid, str(oid)), None),
+        ("podcast page", "podcasts", {"_id": {"$gt": oid}}, [("_id", ASCENDING)]),
+        ("sync lookup", "podcasts", {"api_identifier": {"$in": [1, 2]}}, None),
+        ("user by api identifier", "users", {"api_identifier": oid}, None),
+        ("like of user", "likes", {"episode": str(oid), "user": oid}, None),
+        ("likers page", "likes", {"episode": str(oid), "podcast": oid, "_id": {"$gt": oid}},
+            [("_id", ASCENDING)]),
+        ("likes of podcasts", "likes", {"podcast": {"$in": [oid]}}, None),
+        ("likes of episodes", "likes", {"episode": {"$in": [str(oid)]}}, None),
+        ("likes of user on episodes", "likes", {"episode": {"$in": [str(oid)]}, "user": oid}, None),
+        ("subscription of user", "subscriptions", {"podcast": oid, "user": oid}, None),
+        ("subscribers page", "subscriptions", {"podcast": oid, "_id": {"$gt": oid}}, [("_id", ASCENDING)]),
+        ("subscriptions page", "subscriptions", {"user": oid, "_id": {"$gt": oid}}, [("_id", ASCENDING)]),
+        ("subscriptions of user", "subscriptions", {"user": oid, "podcast": {"$in": [oid]}}, None),
+        ("subscriptions of podcasts", "subscriptions", {"podcast": {"$in": [oid]}}, None),
+    ]
+
+
+def _plan_stages(plan:dict):
+    yield plan.get("stage")
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for stage in plan.get("inputStages", []):
+        yield from _plan_stages(stage)
+
+
+async def audit_indexes() -> list[tuple[str, list[str]]]:
+    """Explains every query shape and reports the problematic stages of their plans
+
+    Returns:
+    --------
+    `list[tuple[str, list[str]]]`: name of each query shape with its COLLSCAN/SORT stages
+    """
+    report = []
+    for name, collection_name, query, sort in _query_shapes():
+        cursor = db[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        stages = _plan_stages(explain["queryPlanner"]["winningPlan"])
+        report.append((name, [stage for stage in stages if stage in ("COLLSCAN", "SORT")]))
+    return report
+
+
+async def _main(command:str):
+    if command == "ensure":
+        await ensure_indexes()
+        return 0
+    failed = False
+    for name, problems in await audit_indexes():
+        print(f"{'WARN' if problems else 'OK  '} {name}" + (f": {', '.join(problems)}" if problems else ""))
+        failed = failed or bool(problems)
+    return int(failed)
+
+
+if __name__ == "__main__":
+    # python -m db.indexes [ensure|audit]
+    sys.exit(asyncio.run(_main(sys.argv[1] if len(sys.argv) > 1 else "audit")))
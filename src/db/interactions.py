@@ -0,0 +1,147 @@
+from datetime import datetime
+
+import bson.errors
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from config import SETTINGS
+from db import delete_each, run_transaction, upsert_each
+from schemas import Interaction, InteractionResult
+from .likes import likes_collection, _episode_query
+from .podcasts import invalidate_feed, invalidate_podcast, like_buffer, podcasts_collection
+from .subscriptions import subscriptions_collection
+
+
+
+async def apply_interactions(user_id:str, operations:list[Interaction]) -> list[InteractionResult]:
+    """Applies like/unlike/subscribe/unsubscribe operations of user, in their order
+
+    Current state of every targeted podcast/episode is read once, operations are
+    replayed on it in memory, and only the net changes are written (inside a transaction
+    when supported). Counters are incremented by the net change of the edges.
+
+    Returns:
+    --------
+    `list[InteractionResult]`: result of each operation (same order as `operations`)
+    """
+    user_id = ObjectId(user_id)
+    podcast_ids = set()
+    for operation in operations:
+        try:
+            podcast_ids.add(ObjectId(operation.podcast_id))
+        except bson.errors.InvalidId:
+            pass
+
+    podcasts = {}
+    async for podcast in podcasts_collection.find(
+        {"_id": {"$in": list(podcast_ids)}},
+        projection={"_id":1, "episodes.id":1},
+    ):
+        podcasts[podcast["_id"]] = podcast
+    subscribed = set()
+    async for subscription in subscriptions_collection.find(
+        {"user": user_id, "podcast": {"$in": list(podcasts)}}, projection={"podcast":1}
+    ):
+        subscribed.add(subscription["podcast"])
+    episodes = {
+        (podcast_id, str(episode["id"]))
+        for podcast_id,podcast in podcasts.items() for episode in podcast.get("episodes", [])
+    }
+    liked = set()
+    if not SETTINGS.LIKES_WRITE_BEHIND:
+        # on the unique (episode, user) index, reading only the likes of the targeted episodes
+        episode_ids = list({
+            operation.episode_id for operation in operations if operation.action in ("like", "unlike")
+        })
+        async for like in likes_collection.find(
+            {"episode": {"$in": episode_ids}, "user": user_id}, projection={"podcast":1, "episode":1}
+        ):
+            liked.add((like["podcast"], like["episode"]))
+
+    results = []
+    likes = {}          # (podcast, episode) -> final state, of every targeted episode
+    subscriptions = {}  # podcast -> final state
+    for operation in operations:
+        try:
+            podcast_id = ObjectId(operation.podcast_id)
+        except bson.errors.InvalidId:
+            podcast_id = None
+        if podcast_id not in podcasts:
+            results.append(InteractionResult(status=404, error="podcast not found"))
+            continue
+        if operation.action in ("like", "unlike"):
+            target = (podcast_id, operation.episode_id)
+            if target not in episodes:
+                results.append(InteractionResult(status=404, error="episode not found"))
+                continue
+            state = operation.action == "like"
+            if SETTINGS.LIKES_WRITE_BEHIND:
+                changed = await like_buffer.record(podcast_id, operation.episode_id, user_id, state)
+            else:
+                changed = likes.get(target, target in liked) != state
+                likes[target] = state
+        else:
+            state = operation.action == "subscribe"
+            changed = subscriptions.get(podcast_id, podcast_id in subscribed) != state
+            subscriptions[podcast_id] = state
+        results.append(InteractionResult(status=201 if changed else 208))
+
+    liked_changes = {target: state for target,state in likes.items() if (target in liked) != state}
+    subscription_changes = {
+        podcast_id: state for podcast_id,state in subscriptions.items() if (podcast_id in subscribed) != state
+    }
+    if liked_changes or subscription_changes:
+        await run_transaction(lambda session: _write_changes(user_id, liked_changes, subscription_changes, session))
+        await invalidate_podcast(*{podcast_id for podcast_id,_ in liked_changes}, *subscription_changes)
+        if subscription_changes:
+            await invalidate_feed(user_id)
+    return results
+
+
+async def _write_changes(user_id:ObjectId, likes:dict, subscriptions:dict, session=None):
+    # counters get the net change of the edges this batch really inserted/deleted (a
+    # concurrent request may have written the same edge since they were read)
+    liked = [target for target,state in likes.items() if state]
+    unliked = [target for target,state in likes.items() if not state]
+    inserted_likes = await upsert_each(likes_collection, [
+        UpdateOne(
+            {"episode": episode_id, "user": user_id},
+            {"$setOnInsert": {"podcast": podcast_id, "date": datetime.utcnow()}},
+            upsert=True,
+        )
+        for podcast_id, episode_id in liked
+    ], session)
+    deleted_likes = await delete_each(likes_collection, [
+        {"episode": episode_id, "user": user_id} for _, episode_id in unliked
+    ], session)
+
+    subscribed = [podcast_id for podcast_id,state in subscriptions.items() if state]
+    unsubscribed = [podcast_id for podcast_id,state in subscriptions.items() if not state]
+    inserted = await upsert_each(subscriptions_collection, [
+        UpdateOne(
+            {"podcast": podcast_id, "user": user_id},
+            {"$setOnInsert": {"notification": False, "date": datetime.utcnow()}},
+            upsert=True,
+        )
+        for podcast_id in subscribed
+    ], session)
+    deleted = await delete_each(subscriptions_collection, [
+        {"podcast": podcast_id, "user": user_id} for podcast_id in unsubscribed
+    ], session)
+    podcast_operations = [
+        UpdateOne({"_id": podcast_id}, {"$inc": {"subscriber_count": delta}})
+        for podcast_id,delta in (
+            *((subscribed[index], 1) for index in inserted),
+            *((podcast_id, -1) for podcast_id,removed in zip(unsubscribed, deleted) if removed),
+        )
+    ]
+    podcast_operations += [
+        UpdateOne(_episode_query(podcast_id, episode_id), {"$inc": {"episodes.$.likes_count": delta}})
+        for (podcast_id, episode_id),delta in (
+            *((liked[index], 1) for index in inserted_likes),
+            *((target, -1) for target,removed in zip(unliked, deleted_likes) if removed),
+        )
+    ]
+
+    if podcast_operations:
+        await podcasts_collection.bulk_write(podcast_operations, ordered=False, session=session)
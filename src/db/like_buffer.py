@@ -0,0 +1,216 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from redis.exceptions import LockError
+
+from config import SETTINGS
+from db import delete_each, upsert_each
+from services import RedisService
+from .likes import likes_collection, podcasts_collection, _episode_query
+
+
+
+logger = logging.getLogger(__name__)
+
+
+# previous state of the user (pending, else processing) read and replaced atomically
+_RECORD_SCRIPT = """
+local previous = redis.call("HGET", KEYS[1], ARGV[1])
+if not previous then
+    previous = redis.call("HGET", KEYS[2], ARGV[1])
+end
+redis.call("HSET", KEYS[1], ARGV[1], ARGV[2])
+redis.call("SADD", KEYS[3], ARGV[3])
+return previous
+"""
+
+
+class LikeBuffer:
+    """Write-behind buffer of like/unlike intents of users
+
+    Intents are recorded in a Redis hash per episode (`user -> 1|0`, so repeated
+    like/unlike of a user coalesce to the last one) and the episode is marked dirty.
+    The flusher (running on every replica, one at a time thanks to a lease lock renewed
+    while it runs) takes the hash of each dirty episode by renaming it to a `processing`
+    key, writes it with batched `bulk_write`s, increments `likes_count` of the episode by
+    the likes it really inserted/deleted and deletes the key. Edge writes are idempotent,
+    so `processing` keys (tracked in a set) left behind by a crashed (or cancelled)
+    flusher are replayed by the next flush, which recounts `likes_count` of those episodes instead.
+
+    Usage:
+    ------
+    ```python
+    await like_buffer.start()   # on app startup
+    changed = await like_buffer.record(podcast_id, episode_id, user_id, liked=True)
+    await like_buffer.state(podcast_id, episode_id, user_id)   # True (not flushed yet)
+    ```
+    """
+    dirty_key = "likes:dirty"
+    processing_set_key = "likes:processing"  # episodes with a `processing` key
+    lock_key = "likes:flush"
+
+    def __init__(self, redis:RedisService=None, on_flush:Callable[[ObjectId], Awaitable]|None=None):
+        self.redis = redis or RedisService()
+        self.on_flush = on_flush  # called with id of every podcast whose likes were written
+        self._task : asyncio.Task|None = None
+        self._wakeup = asyncio.Event()
+        self._recorded = 0
+        self._record_script = self.redis.client.register_script(_RECORD_SCRIPT)
+
+    def _pending_key(self, podcast_id, episode_id) -> str:
+        return f"likes:pending:{podcast_id}:{episode_id}"
+
+    def _processing_key(self, podcast_id, episode_id) -> str:
+        return f"likes:processing:{podcast_id}:{episode_id}"
+
+
+    async def record(self, podcast_id:ObjectId, episode_id:str, user_id:ObjectId, liked:bool) -> bool:
+        """Buffers a like (or unlike) intent of user
+
+        Returns:
+        --------
+        `bool`: False if the episode was already liked (or not liked) by user
+        """
+        previous = await self._record_script(
+            keys=[self._pending_key(podcast_id, episode_id), self._processing_key(podcast_id, episode_id), self.dirty_key],
+            args=[str(user_id), int(liked), f"{podcast_id}:{episode_id}"],
+        )
+        if previous is None:
+            previous = await likes_collection.find_one(
+                {"episode": episode_id, "user": user_id}, projection={"_id":1}
+            ) is not None
+        else:
+            previous = previous == b"1"
+        self._recorded += 1
+        if self._recorded >= SETTINGS.LIKES_FLUSH_SIZE:
+            self._wakeup.set()
+        return previous != liked
+
+    async def state(self, podcast_id:ObjectId, episode_id:str, user_id:ObjectId) -> bool|None:
+        """Like state of user that is not written to the database yet (`None` if there is none)"""
+        pipe = self.redis.pipeline()
+        pipe.hget(self._pending_key(podcast_id, episode_id), str(user_id))
+        pipe.hget(self._processing_key(podcast_id, episode_id), str(user_id))
+        pending, processing = await pipe.execute()
+        value = pending if pending is not None else processing
+        return None if value is None else value == b"1"
+
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("last flush of buffered likes failed")
+
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), SETTINGS.LIKES_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            self._recorded = 0
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("flushing buffered likes failed")
+
+    async def flush(self) -> int:
+        """Writes the buffered intents to the database
+
+        Returns:
+        --------
+        `int`: number of written intents (0 if another replica is flushing)
+        """
+        lock = self.redis.lock(self.lock_key, SETTINGS.LIKES_FLUSH_LOCK_TTL)
+        if not await lock.acquire(blocking=False):
+            return 0
+        try:
+            return await self.redis.run_with_lease(lock, self._flush())
+        finally:
+            try:
+                await lock.release()
+            except LockError:
+                pass
+
+    async def _flush(self) -> int:
+        written = 0
+        # replay what a crashed flusher left behind
+        for episode in await self.redis.smembers(self.processing_set_key):
+            written += await self._write(self._processing_key(*episode.split(":", 1)), replayed=True)
+        for episode in await self.redis.smembers(self.dirty_key):
+            podcast_id, episode_id = episode.split(":", 1)
+            processing_key = self._processing_key(podcast_id, episode_id)
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.renamenx(self._pending_key(podcast_id, episode_id), processing_key)
+            pipe.srem(self.dirty_key, episode)
+            pipe.sadd(self.processing_set_key, episode)
+            renamed, _, _ = await pipe.execute(raise_on_error=False)
+            # an error means there is no pending key (already taken), the episode added to
+            # the processing set anyway is dropped by the next replay
+            if renamed is True:
+                written += await self._write(processing_key)
+            elif renamed is False:
+                # a previous batch of the episode is still there, next flush takes this one
+                await self.redis.sadd(self.dirty_key, episode)
+        return written
+
+    async def _write(self, processing_key:str, replayed:bool=False) -> int:
+        _, _, podcast_id, episode_id = processing_key.split(":", 3)
+        podcast_id = ObjectId(podcast_id)
+        intents = await self.redis.hgetall(processing_key)
+        if not intents:
+            # already written (or never renamed, see `_flush`)
+            await self.redis.srem(self.processing_set_key, f"{podcast_id}:{episode_id}")
+            return 0
+        liked = [ObjectId(user_id) for user_id,state in intents.items() if state == "1"]
+        unliked = [ObjectId(user_id) for user_id,state in intents.items() if state != "1"]
+        delta = 0
+        for start in range(0, len(liked), SETTINGS.LIKES_FLUSH_SIZE):
+            delta += len(await upsert_each(likes_collection, [
+                UpdateOne(
+                    {"episode": episode_id, "user": user_id},
+                    {"$setOnInsert": {"podcast": podcast_id, "date": datetime.utcnow()}},
+                    upsert=True,
+                )
+                for user_id in liked[start:start+SETTINGS.LIKES_FLUSH_SIZE]
+            ]))
+        for start in range(0, len(unliked), SETTINGS.LIKES_FLUSH_SIZE):
+            delta -= sum(await delete_each(likes_collection, [
+                {"episode": episode_id, "user": user_id} for user_id in unliked[start:start+SETTINGS.LIKES_FLUSH_SIZE]
+            ]))
+
+        if replayed:
+            # the crashed flusher may have written the likes without counting them
+            likes_count = await likes_collection.count_documents({"episode": episode_id, "podcast": podcast_id})
+            update = {"$set": {"episodes.$.likes_count": likes_count}}
+        else:
+            update = {"$inc": {"episodes.$.likes_count": delta}}
+        counted = await podcasts_collection.update_one(_episode_query(podcast_id, episode_id), update)
+        if counted.matched_count == 0:
+            # no such episode
+            await likes_collection.delete_many({"episode": episode_id, "podcast": podcast_id})
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(processing_key)
+        pipe.srem(self.processing_set_key, f"{podcast_id}:{episode_id}")
+        await pipe.execute()
+        if self.on_flush:
+            await self.on_flush(podcast_id)
+        return len(intents)
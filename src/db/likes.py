@@ -0,0 +1,121 @@
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import ASCENDING, IndexModel, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from db import db
+
+
+
+# Likes are `(episode, user)` documents of their own collection. Episodes (embedded in
+# podcasts) only keep a `likes_count` counter, so podcasts do not grow with their likes.
+likes_collection = db["likes"]
+podcasts_collection = db["podcasts"]
+users_collection = db["users"]
+
+LIKE_INDEXES = [
+    IndexModel([("episode", ASCENDING), ("user", ASCENDING)], unique=True),
+    IndexModel([("episode", ASCENDING), ("_id", ASCENDING)]),
+    IndexModel([("podcast", ASCENDING)]),
+]
+
+
+def _episode_query(podcast_id:ObjectId, episode_id:str) -> dict:
+    return {"_id": podcast_id, "episodes.id": episode_id}
+
+
+async def add_like(podcast_id:ObjectId, episode_id:str, user_id:ObjectId, session=None) -> bool:
+    """Saves like of user, returns False if the episode was already liked by user"""
+    try:
+        await likes_collection.insert_one(
+            {"podcast": podcast_id, "episode": episode_id, "user": user_id, "date": datetime.utcnow()},
+            session=session,
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+async def remove_like(podcast_id:ObjectId, episode_id:str, user_id:ObjectId, session=None) -> bool:
+    """Deletes like of user, returns False if the episode was not liked by user"""
+    removed = await likes_collection.delete_one(
+        {"podcast": podcast_id, "episode": episode_id, "user": user_id}, session=session
+    )
+    return removed.deleted_count == 1
+
+
+async def count_like(podcast_id:ObjectId, episode_id:str, delta:int, session=None):
+    """Adds `delta` to the like counter of the episode (`matched_count` is 0 if there is no such episode)"""
+    return await podcasts_collection.update_one(
+        _episode_query(podcast_id, episode_id), {"$inc": {"episodes.$.likes_count": delta}},
+        session=session,
+    )
+
+
+async def get_episode_likers(podcast_id:ObjectId, episode_id:str, after:ObjectId|None, limit:int):
+    """Keyset page of users who liked the episode (newest likes last)
+
+    Returns:
+    --------
+    `tuple[list[dict], ObjectId|None]`: likes of the page and `_id` to continue after (if any)
+    """
+    query = {"episode": episode_id, "podcast": podcast_id}
+    if after:
+        query["_id"] = {"$gt": after}
+    likes = await likes_collection.find(
+        query, projection={"_id":1, "user":1, "date":1}
+    ).sort("_id", ASCENDING).limit(limit + 1).to_list(limit + 1)
+    next_id = likes[limit-1]["_id"] if len(likes) > limit else None
+    return [{"user": like["user"], "date": like["date"]} for like in likes[:limit]], next_id
+
+
+async def delete_podcast_likes(*podcast_ids:ObjectId):
+    await likes_collection.delete_many({"podcast": {"$in": list(podcast_ids)}})
+
+
+async def delete_episode_likes(episode_ids:list[str]):
+    await likes_collection.delete_many({"episode": {"$in": episode_ids}})
+
+
+
+async def migrate_embedded_likes():
+    """Moves likes embedded in `podcasts.episodes.likes` (old layout) to the likes collection
+    and drops `users.liked_episodes`
+    """
+    async for podcast in podcasts_collection.find(
+        {"episodes.likes.0": {"$exists": True}}, projection={"episodes.id":1, "episodes.likes":1}
+    ):
+        operations = []
+        for episode in podcast["episodes"]:
+            for user_id in episode.get("likes", []):
+                operations.append(UpdateOne(
+                    {"episode": episode["id"], "user": user_id},
+                    {"$setOnInsert": {"podcast": podcast["_id"], "date": datetime.utcnow()}},
+                    upsert=True,
+                ))
+        if operations:
+            await likes_collection.bulk_write(operations, ordered=False)
+        # every episode counted with one aggregate (on the `podcast` index) and one bulk write
+        counts = {
+            group["_id"]: group["count"] async for group in likes_collection.aggregate([
+                {"$match": {"podcast": podcast["_id"]}},
+                {"$group": {"_id": "$episode", "count": {"$sum": 1}}},
+            ])
+        }
+        await podcasts_collection.bulk_write([
+            UpdateOne(
+                _episode_query(podcast["_id"], episode["id"]),
+                {
+                    "$set": {"episodes.$.likes_count": counts.get(episode["id"], 0)},
+                    "$unset": {"episodes.$.likes": ""},
+                },
+            )
+            for episode in podcast["episodes"]
+        ], ordered=False)
+    # likes of users are read from the likes collection, their embedded copy is dropped
+    await users_collection.update_many({"liked_episodes": {"$exists": True}}, {"$unset": {"liked_episodes": ""}})
+
+if __name__ == "__main__":
+    import asyncio
+    asyncio.run(migrate_embedded_likes())
@@ -1,15 +1,60 @@
+from typing import Awaitable, Callable
+
 from bson import ObjectId
 
-from db import db
+from db import Rollback, db, run_transaction, run_writes
+from db.like_buffer import LikeBuffer
+from db.likes import add_like, count_like, likes_collection, remove_like
+from db.subscriptions import add_subscription, count_subscription, remove_subscription
 from config import SETTINGS
-from schemas import Podcast,Episode, UserLikeStruct
-from services import PodcastAPIService
+from schemas.encoding import mongo_document
+from services import CacheService, PodcastAPIService
 
 
 
 podcast_service = PodcastAPIService(SETTINGS.PODCASTS_URL)
 podcasts_collection = db["podcasts"]
 episodes_collection = db["episodes"]
+users_collection = db["users"]
+
+cache = CacheService()
+
+
+def podcast_cache_tag(podcast_id:str|ObjectId) -> str:
+    return f"podcast:{podcast_id}"
+
+
+# version of the podcast list (see `CacheService.version`), podcasts are versioned by their cache tag
+PODCAST_LIST_VERSION = "podcasts"
+
+
+async def invalidate_podcast(*podcast_ids:str|ObjectId):
+    """Drops every cached response built from the given podcasts and bumps their versions"""
+    await cache.invalidate_tags(*map(podcast_cache_tag, podcast_ids))
+
+
+async def invalidate_podcast_list():
+    await cache.bump(PODCAST_LIST_VERSION)
+
+
+def feed_cache_tag(user_id:str|ObjectId) -> str:
+    return f"feed:{user_id}"
+
+
+# version of every feed (see `CacheService.version`), part of feed cache keys
+FEED_VERSION = "feeds"
+
+
+async def invalidate_feed(user_id:str|ObjectId):
+    await cache.invalidate_tags(feed_cache_tag(user_id))
+
+
+async def invalidate_feeds():
+    """Outdates cached feeds of all users (e.g. after a sync changed podcasts)"""
+    await cache.bump(FEED_VERSION)
+
+
+like_buffer = LikeBuffer(on_flush=invalidate_podcast)
 
 
 async def get_by_id(collection_name:str, id:str|ObjectId):
@@ -23,6 +68,17 @@ def get_episode_query(podcast_id,episode_id):
     return query
 
 
+# fields of podcast list items, documents projected to them are served as they are read
+PODCAST_LIST_PROJECTION = {"_id":1, "api_identifier":1}
+
+def find_podcasts(after:ObjectId|None, limit:int):
+    """Cursor of (at most `limit`) podcasts with `_id` greater than `after`, projected to
+    `PODCAST_LIST_PROJECTION`
+    """
+    query = {"_id": {"$gt": after}} if after else {}
+    return podcasts_collection.find(query, projection=PODCAST_LIST_PROJECTION).sort("_id", 1).limit(limit)
+
+
 async def get_podcast_list():
     resp = await podcast_service.podcast_list()
     if not resp:
@@ -31,192 +87,222 @@ async def get_podcast_list():
 
 
 async def get_podcast_details(identifier:str|ObjectId):
-    podcast = await get_by_id("podcasts", identifier)
+    return await cache.get_or_load(
+        f"podcast:{identifier}",
+        lambda: _load_podcast_details(identifier),
+        tags=[podcast_cache_tag(identifier)],
+    )
+
+async def _load_podcast_details(identifier:str|ObjectId):
+    if type(identifier) is str:
+        identifier = ObjectId(identifier)
+    podcast = await podcasts_collection.find_one({"_id": identifier}, projection={"fingerprint":0})
     if podcast is None: return
-    podcast = Podcast(**podcast)
-    resp = await podcast_service.podcast_details(podcast.api_identifier)
-    resp_data = resp.data
-    # NOTE: line below must be made to a function to be used for all schemas
-    # Also the excludes from both (resp and podcast) must be previously defined
-    data = {**resp_data["podcast"], **podcast.model_dump(exclude=["api_identifier"])}
-    return data
+    resp = await podcast_service.podcast_details(podcast.pop("api_identifier"))
+    if not resp: return
+    return {**resp.data["podcast"], **mongo_document(podcast)}
 
 
-# async def get_podcast_episode_list(podcast_identifier):
-#     resp = await podcast_service.podcast_episode_list(podcast_identifier)
-#     if not resp: return None
-#     resp_episodes = resp.data["episodes"]
-#     print(resp_episodes)
-#     episode_db_ids = [episode["id"] for episode in resp_episodes]
-#     db_episodes = db["episodes"].find({
-#         "api_identifier" : {"$in":episode_db_ids},
-#     })
-#     db_episodes = list(map(lambda episode:Episode(**episode).model_dump(), await db_episodes.to_list(100)))
-#     data = merge_episodes(db_episodes, resp_episodes)
-#     return data
+async def get_podcast_episode_list(podcast_id:str|ObjectId, offset:int, limit:int):
+    return await cache.get_or_load(
+        f"podcast:{podcast_id}:episodes:{offset}:{limit}",
+        lambda: _load_podcast_episode_list(podcast_id, offset, limit),
+        tags=[podcast_cache_tag(podcast_id)],
+    )
 
-# def merge_episodes(db, resp):
-#     data = []
-#     for db_episode in db:
-#         api_identifier = db_episode["api_identifier"]
-#         for resp_episode in resp:
-#             if resp_episode["id"] == api_identifier:
-#                 data.append({**db_episode,**resp_episode})
-#     return data
+async def _load_podcast_episode_list(podcast_id:str|ObjectId, offset:int, limit:int):
+    if type(podcast_id) is str:
+        podcast_id = ObjectId(podcast_id)
+    # only the requested page of embedded episodes is loaded from db
+    podcast = await podcasts_collection.find_one(
+        {"_id": podcast_id},
+        projection={"api_identifier":1, "episodes": {"$slice": [offset, limit]}}
+    )
+    if podcast is None: return
+    resp = await podcast_service.podcast_episode_list(podcast["api_identifier"])
+    if not resp: return
+    db_episodes = podcast.get("episodes", [])
+    return {
+        "items": merge_episodes(db_episodes, resp.data["episodes"]),
+        "next": (offset + limit) if len(db_episodes) == limit else None,
+    }
+
+def merge_episodes(db_episodes:list[dict], resp_episodes:list[dict]) -> list[dict]:
+    """Joins db episodes with catalog episodes on `api_identifier`
+
+    Catalog episodes are indexed in a dict first, so it takes O(n+m) instead of the nested loop.
+    Episodes missing from the catalog are skipped.
+    """
+    resp_by_id = {episode["id"]: episode for episode in resp_episodes}
+    data = []
+    for db_episode in db_episodes:
+        resp_episode = resp_by_id.get(db_episode["api_identifier"])
+        if resp_episode is not None:
+            data.append({
+                **resp_episode,
+                "id": db_episode["id"],
+                "likes": db_episode.get("likes_count", 0),
+            })
+    return data
 
 
 
 async def get_podcast_episode_details(podcast_id:str|ObjectId, episode_id:str|ObjectId):
+    return await cache.get_or_load(
+        f"podcast:{podcast_id}:episode:{episode_id}",
+        lambda: _load_podcast_episode_details(podcast_id, episode_id),
+        tags=[podcast_cache_tag(podcast_id)],
+    )
+
+async def _load_podcast_episode_details(podcast_id:str|ObjectId, episode_id:str|ObjectId):
     query = get_episode_query(podcast_id,episode_id)
     projection = {"episodes.$": 1,"api_identifier":1}
     podcast = await podcasts_collection.find_one(query,projection=projection)
     if not podcast: return
-    podcast = Podcast.model_validate(podcast)
-    episode = Episode.model_validate(podcast.episodes[0])
+    episode = podcast["episodes"][0]
 
-    resp = await podcast_service.podcast_episode_details(podcast.api_identifier,episode.api_identifier)
+    resp = await podcast_service.podcast_episode_details(podcast["api_identifier"],episode["api_identifier"])
     if not resp: return
 
-    return {**(resp.data["episode"]), "likes":episode.model_dump()["likes"]}
+    return {**(resp.data["episode"]), "likes":episode.get("likes_count", 0)}
 
 
 
 async def like_episode(podcast_id:str,episode_id:str, user_id:str) -> bool:
-    #] Episode validation
-    # episode = await get_podcast_episode_details(episode_id)
-    # if not episode: return
+    """Likes the episode for user
+
+    Returns:
+    --------
+    `bool`: False if the episode was already liked by user (or does not exist)
+    """
     #] User validation.  NOTE: we suppose the user is already validated
-    # user = await
-    # if not user: return
     podcast_id = ObjectId(podcast_id)
     user_id = ObjectId(user_id)
-    add_to_podcast = await podcasts_collection.update_one(
-        get_episode_query(podcast_id,episode_id),
-        {"$addToSet": {"episodes.$.likes": user_id}
-    })
-    add_to_user = await db["users"].update_one(
-        {"api_identifier":user_id},
-        {"$addToSet": {
-            "liked_episodes": UserLikeStruct(
-                podcast_identifier=podcast_id,
-                episode_identifier=episode_id
-            ).model_dump()
-        }}
+    episode_id = str(episode_id)
+    if SETTINGS.LIKES_WRITE_BEHIND:
+        return await like_buffer.record(podcast_id, episode_id, user_id, liked=True)
+    liked = await _write_edge(
+        lambda session: add_like(podcast_id, episode_id, user_id, session),
+        lambda session, delta: count_like(podcast_id, episode_id, delta, session),
+        lambda: remove_like(podcast_id, episode_id, user_id),
+        delta=1,
     )
-
-    if add_to_user.matched_count == 0:
-        print("here")
-        res = await db["users"].insert_one({
-            "api_identifier": user_id,
-            "liked_episodes": [
-                UserLikeStruct(podcast_identifier=podcast_id, episode_identifier=episode_id).model_dump()
-            ]
-        })
-        return True
-    assert add_to_podcast.modified_count  ==  add_to_user.modified_count, "invalid data found in db"
-    if (add_to_podcast.modified_count != 1)  or  (add_to_user.modified_count != 1):
-        return False
-    return True
+    if liked:
+        await invalidate_podcast(podcast_id)
+    return liked
 
 
 async def unlike_episode(podcast_id:str, episode_id:str, user_id:str) -> bool:
-    #] Episode validation
-    # episode = await get_podcast_episode_details(episode_id)
-    # if not episode: return
+    """Removes like of user from the episode
+
+    Returns:
+    --------
+    `bool`: False if the episode was not liked by user
+    """
     #] User validation.  NOTE: we suppose the user is already validated
-    # user = await
-    # if not user: return
     podcast_id = ObjectId(podcast_id)
     user_id = ObjectId(user_id)
-    rem_from_episode = await podcasts_collection.update_one(
-        get_episode_query(podcast_id,episode_id),
-        {"$pull": {"episodes.$.likes": user_id}
-    })
-    rem_from_user = await db["users"].update_one(
-        {"api_identifier":user_id},
-        {"$pull": {
-            "liked_episodes": {"episode_identifier":episode_id}
-        }}
+    episode_id = str(episode_id)
+    if SETTINGS.LIKES_WRITE_BEHIND:
+        return await like_buffer.record(podcast_id, episode_id, user_id, liked=False)
+    unliked = await _write_edge(
+        lambda session: remove_like(podcast_id, episode_id, user_id, session),
+        lambda session, delta: count_like(podcast_id, episode_id, delta, session),
+        lambda: add_like(podcast_id, episode_id, user_id),
+        delta=-1,
     )
-    assert rem_from_episode.modified_count  ==  rem_from_user.modified_count, "invalid data found in db"
-    if (rem_from_episode.modified_count != 1)  or  (rem_from_user.modified_count != 1):
-        return False
-    return True
-
-
+    if unliked:
+        await invalidate_podcast(podcast_id)
+    return unliked
 
-async def subscribe_podcast(podcast_id:str, user_id:str) -> bool:
+async def is_episode_liked(podcast_id:str, episode_id:str, user_id:str) -> bool:
+    """Like state of user, including buffered (not yet written) likes in write-behind mode"""
     podcast_id = ObjectId(podcast_id)
     user_id = ObjectId(user_id)
-    add_to_podcast =  await db["podcasts"].find_one_and_update(
-        {"_id": podcast_id},
-        {"$addToSet": {"subscribers": {"user":user_id}}}
-                                          #? Make `PodcastSubsStruct` and then dump it?
-    )
-    add_to_user = await db["users"].update_one(
-        {"api_identifier": user_id},
-        {"$addToSet": {"subscriptions": {"podcast":podcast_id}}}
-                                              #? Make `UserSubsStruct` and then dump it?
-    )
-    if add_to_user.matched_count == 0:
-        res = await db["users"].insert_one({
-            "api_identifier": user_id,
-            "subscriptions": {"podcast":podcast_id}
-        })
-    assert add_to_podcast.modified_count  ==  add_to_user.modified_count, "invalid data found in db"
-    if (add_to_podcast.modified_count != 1)  or  (add_to_user.modified_count != 1):
+    episode_id = str(episode_id)
+    if SETTINGS.LIKES_WRITE_BEHIND:
+        liked = await like_buffer.state(podcast_id, episode_id, user_id)
+        if liked is not None:
+            return liked
+    return await likes_collection.find_one(
+        {"episode": episode_id, "user": user_id}, projection={"_id":1}
+    ) is not None
+
+async def _write_edge(
+    write:Callable[..., Awaitable[bool]],
+    count:Callable[..., Awaitable],
+    undo:Callable[[], Awaitable],
+    delta:int,
+) -> bool:
+    """Writes an edge (like, subscription) and adds `delta` to its counter
+
+    Without a transaction (see `run_transaction`) both writes run concurrently, and the
+    one that applied is undone when the other did not: the edge was already in that state
+    (`write` returned False) or, for new edges, the counted document does not exist.
+
+    Args:
+    -----
+    - write `(Callable)`: _called with the session, returns False if the edge did not change_
+    - count `(Callable)`: _called with the session and a delta, returns the `UpdateResult`_
+    - undo `(Callable)`: _reverts `write` (without a transaction)_
+    - delta `(int)`: _1 for added edges, -1 for removed ones_
+    """
+    async def operation(session):
+        changed, counted = await run_writes(write, lambda session: count(session, delta), session=session)
+        # removed edges of missing documents (e.g. deleted by a sync) have nothing to count
+        if changed and (counted.matched_count or delta < 0):
+            return True
+        if session is not None:
+            raise Rollback
+        if counted.matched_count:
+            await count(None, -delta)
+        if changed:
+            await undo()
         return False
-    return True
 
-async def unsubscribe_podcast(podcast_id:ObjectId, user_id:ObjectId) -> bool:
-    rem_from_episode = await db["podcasts"].update_one(
-        {"_id": podcast_id},
-        {"$pull": {"subscribers": {"user":user_id}}}  #? Make `PodcastSubsStruct` and then dump it?
-    )
-    rem_from_user = await db["users"].update_one(
-        {"api_identifier": user_id},
-        {"$pull": {"subscriptions": {"podcast":podcast_id}}}  #? Make `UserSubsStruct` and then dump it?
-    )
-    assert rem_from_episode.modified_count  ==  rem_from_user.modified_count, "invalid data found in db"
-    if (rem_from_episode.modified_count != 1)  or  (rem_from_user.modified_count != 1):
+    try:
+        return await run_transaction(operation)
+    except Rollback:
         return False
-    return True
 
 
 
-async def update_db():  #? make this a celery task? (Problems: 3.async db  2.Async api service)
-    #] Create unsaved podcasts
-    # retrive podcast list
-    podcasts = (await podcast_service.podcast_list()).data["podcasts"]
-    podcast_ids = set(map(lambda podcast:podcast['id'], podcasts)) # This must be a method in podcastService
-
-    #? remove podcasts in db that are not represent in responses
+async def subscribe_podcast(podcast_id:str, user_id:str) -> bool:
+    """Subscribes user to the podcast
 
-    # Check for new podcasts
-    db_podcasts = podcasts_collection.find({
-        "api_identifier":{"$in":list(podcast_ids)}},
-        projection={"_id":0, "api_identifier":1}
+    Returns:
+    --------
+    `bool`: False if user was already subscribed (or podcast does not exist)
+    """
+    podcast_id = ObjectId(podcast_id)
+    user_id = ObjectId(user_id)
+    subscribed = await _write_edge(
+        lambda session: add_subscription(podcast_id, user_id, session),
+        lambda session, delta: count_subscription(podcast_id, delta, session),
+        lambda: remove_subscription(podcast_id, user_id),
+        delta=1,
+    )
+    if subscribed:
+        await invalidate_podcast(podcast_id)
+        await invalidate_feed(user_id)
+    return subscribed
+
+async def unsubscribe_podcast(podcast_id:str, user_id:str) -> bool:
+    """Unsubscribes user from the podcast
+
+    Returns:
+    --------
+    `bool`: False if user was not subscribed
+    """
+    podcast_id = ObjectId(podcast_id)
+    user_id = ObjectId(user_id)
+    unsubscribed = await _write_edge(
+        lambda session: remove_subscription(podcast_id, user_id, session),
+        lambda session, delta: count_subscription(podcast_id, delta, session),
+        lambda: add_subscription(podcast_id, user_id),
+        delta=-1,
     )
-    db_podcasts_ids = {podcast['api_identifier'] for podcast in (await db_podcasts.to_list(100))}
-    unsaved_podcasts_ids = podcast_ids - db_podcasts_ids
-
-    for podcast_id in unsaved_podcasts_ids:
-        # retrieve episodes
-        episodes = (await podcast_service.podcast_episode_list(podcast_id))
-        db_episode_list = [
-            Episode.model_validate({"api_identifier":episode["id"],"_id":ObjectId()}).
-                model_dump() for episode in episodes.data["episodes"]
-        ]
-        # check and create new episodes in db
-        # await episodes_collection.insert_many(db_episode_list)
-        await podcasts_collection.insert_one({
-            "api_identifier": podcast_id,
-            "subscribers": [],
-            "episodes": db_episode_list
-        })
-
-
-    #] Update existing podcasts
-    #? remove episodes in db that are not represent in responses
-    # publish updated podcast data to rabbit (for `notification` micro-service)
-    ...
+    if unsubscribed:
+        await invalidate_podcast(podcast_id)
+        await invalidate_feed(user_id)
+    return unsubscribed
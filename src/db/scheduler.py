@@ -0,0 +1,156 @@
+import asyncio
+import json
+import logging
+import time
+from uuid import uuid4
+
+from redis.exceptions import LockError
+
+from config import SETTINGS
+from schemas import SyncStats
+from services import LeaseLost, RedisService
+from .sync import update_db
+
+
+
+logger = logging.getLogger(__name__)
+
+
+class SyncScheduler:
+    """Runs `update_db` in the background of the app
+
+    Syncs run on every `SETTINGS.SYNC_INTERVAL` seconds and whenever one is enqueued (by
+    `enqueue`). All replicas run a scheduler, but a Redis lease lock (renewed while a sync
+    runs, for at most `SETTINGS.SYNC_MAX_DURATION` seconds) lets only one of them sync at
+    a time. Jobs are stored in Redis hashes, so the
+    status of a job can be read from any replica.
+
+    Usage:
+    ------
+    ```python
+    await sync_scheduler.start()   # on app startup
+    job_id = await sync_scheduler.enqueue()
+    await sync_scheduler.job(job_id)   # {"status": "running", "progress": ..., ...}
+    ```
+    """
+    lock_key = "sync:lock"
+    queue_key = "sync:queue"
+    pending_key = "sync:pending"
+    last_run_key = "sync:last_run"
+    last_job_key = "sync:last_job"
+    last_error_key = "sync:last_error"
+
+    def __init__(self, redis:RedisService=None):
+        self.redis = redis or RedisService()
+        self._task : asyncio.Task|None = None
+
+    def _job_key(self, job_id:str) -> str:
+        return f"sync:job:{job_id}"
+
+
+    async def enqueue(self, trigger:str="api") -> str:
+        """Queues a sync run, or returns the id of the one that is already waiting"""
+        job_id = uuid4().hex
+        if not await self.redis.set(self.pending_key, job_id, nx=True):
+            pending_id = await self.redis.get(self.pending_key)
+            if pending_id:
+                return pending_id
+            await self.redis.set(self.pending_key, job_id)
+        await self.redis.hset(self._job_key(job_id), {
+            "id": job_id, "status": "queued", "trigger": trigger, "queued_at": time.time(),
+        })
+        await self.redis.rpush(self.queue_key, job_id)
+        return job_id
+
+    async def job(self, job_id:str) -> dict|None:
+        job = await self.redis.hgetall(self._job_key(job_id))
+        if "progress" in job:
+            job["progress"] = json.loads(job["progress"])
+        return job or None
+
+    async def status(self) -> dict:
+        last_job_id = await self.redis.get(self.last_job_key)
+        return {
+            "last_job": last_job_id and await self.job(last_job_id),
+            "last_error": await self.redis.get(self.last_error_key),
+        }
+
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await self._tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("sync scheduler tick failed")
+            await asyncio.sleep(SETTINGS.SYNC_POLL_INTERVAL)
+
+    async def _tick(self):
+        lock = self.redis.lock(self.lock_key, SETTINGS.SYNC_LOCK_TTL)
+        if not await lock.acquire(blocking=False):
+            return
+        try:
+            job_id = await self.redis.lpop(self.queue_key)
+            if job_id is not None:
+                await self.redis.delete(self.pending_key)
+            elif await self._is_due():
+                job_id = uuid4().hex
+                await self.redis.hset(self._job_key(job_id), {
+                    "id": job_id, "status": "queued", "trigger": "schedule", "queued_at": time.time(),
+                })
+            if job_id is not None:
+                await self._execute(job_id, lock)
+        finally:
+            try:
+                await lock.release()
+            except LockError:
+                pass
+
+    async def _is_due(self) -> bool:
+        if not SETTINGS.SYNC_INTERVAL:
+            return False
+        last_run = await self.redis.get(self.last_run_key)
+        return (last_run is None) or (time.time() - float(last_run) >= SETTINGS.SYNC_INTERVAL)
+
+    async def _execute(self, job_id:str, lock):
+        job_key = self._job_key(job_id)
+        started = time.time()
+        await self.redis.set(self.last_run_key, started, ttl=max(SETTINGS.SYNC_INTERVAL, 1)*2)
+        await self.redis.set(self.last_job_key, job_id)
+        await self.redis.hset(job_key, {"status": "running", "started_at": started})
+
+        async def report(stats:SyncStats):
+            try:
+                await self.redis.hset(job_key, {"progress": stats.model_dump_json()})
+            except Exception:
+                logger.exception("could not report progress of sync %s", job_id)
+
+        try:
+            stats = await self.redis.run_with_lease(lock, update_db(progress=report), SETTINGS.SYNC_MAX_DURATION)
+        except Exception as e:
+            # a stuck sync (or one whose lock was lost) is cancelled, see `run_with_lease`
+            error = str(e) if isinstance(e, LeaseLost) else f"{type(e).__name__}: {e}"
+            logger.error("sync %s failed: %s", job_id, error)
+            result = {"status": "failed", "error": error}
+            await self.redis.set(self.last_error_key, error)
+        else:
+            result = {"status": "succeeded", "progress": stats.model_dump_json()}
+        result.update(finished_at=time.time(), duration=time.time() - started)
+        await self.redis.hset(job_key, result)
+
+
+sync_scheduler = SyncScheduler()
@@ -0,0 +1,127 @@
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import ASCENDING, IndexModel, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from db import db
+
+
+
+# Subscriptions are `(podcast, user)` edges of their own collection, indexed for both
+# directions. Podcasts only keep a `subscriber_count` counter, so they do not grow with
+# their subscribers (and users do not grow with their subscriptions).
+subscriptions_collection = db["subscriptions"]
+podcasts_collection = db["podcasts"]
+users_collection = db["users"]
+
+SUBSCRIPTION_INDEXES = [
+    IndexModel([("podcast", ASCENDING), ("user", ASCENDING)], unique=True),
+    IndexModel([("podcast", ASCENDING), ("_id", ASCENDING)]),
+    IndexModel([("user", ASCENDING), ("_id", ASCENDING)]),
+]
+
+
+async def add_subscription(podcast_id:ObjectId, user_id:ObjectId, session=None) -> bool:
+    """Saves subscription of user, returns False if user was already subscribed to the podcast"""
+    try:
+        await subscriptions_collection.insert_one(
+            {"podcast": podcast_id, "user": user_id, "notification": False, "date": datetime.utcnow()},
+            session=session,
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+async def remove_subscription(podcast_id:ObjectId, user_id:ObjectId, session=None) -> bool:
+    """Deletes subscription of user, returns False if user was not subscribed"""
+    removed = await subscriptions_collection.delete_one(
+        {"podcast": podcast_id, "user": user_id}, session=session
+    )
+    return removed.deleted_count == 1
+
+
+async def count_subscription(podcast_id:ObjectId, delta:int, session=None):
+    """Adds `delta` to the subscriber counter of the podcast (`matched_count` is 0 if there is no such podcast)"""
+    return await podcasts_collection.update_one(
+        {"_id": podcast_id}, {"$inc": {"subscriber_count": delta}}, session=session
+    )
+
+
+async def is_subscribed(podcast_id:ObjectId, user_id:ObjectId) -> bool:
+    return await subscriptions_collection.find_one(
+        {"podcast": podcast_id, "user": user_id}, projection={"_id":1}
+    ) is not None
+
+
+async def _page(query:dict, field:str, after:ObjectId|None, limit:int):
+    if after:
+        query["_id"] = {"$gt": after}
+    subscriptions = await subscriptions_collection.find(
+        query, projection={"_id":1, field:1, "date":1}
+    ).sort("_id", ASCENDING).limit(limit + 1).to_list(limit + 1)
+    next_id = subscriptions[limit-1]["_id"] if len(subscriptions) > limit else None
+    return [{field: subscription[field], "date": subscription["date"]} for subscription in subscriptions[:limit]], next_id
+
+
+async def get_podcast_subscribers(podcast_id:ObjectId, after:ObjectId|None, limit:int):
+    """Keyset page of users subscribed to the podcast (newest subscriptions last)
+
+    Returns:
+    --------
+    `tuple[list[dict], ObjectId|None]`: subscriptions of the page and `_id` to continue after (if any)
+    """
+    return await _page({"podcast": podcast_id}, "user", after, limit)
+
+
+async def get_user_subscriptions(user_id:ObjectId, after:ObjectId|None, limit:int):
+    """Keyset page of podcasts user is subscribed to (newest subscriptions last)
+
+    Returns:
+    --------
+    `tuple[list[dict], ObjectId|None]`: subscriptions of the page and `_id` to continue after (if any)
+    """
+    return await _page({"user": user_id}, "podcast", after, limit)
+
+
+async def delete_podcast_subscriptions(*podcast_ids:ObjectId):
+    await subscriptions_collection.delete_many({"podcast": {"$in": list(podcast_ids)}})
+
+
+
+async def migrate_embedded_subscriptions():
+    """Moves subscriptions embedded in `podcasts.subscribers` and `users.subscriptions`
+    (old layout) to the subscriptions collection
+    """
+    async for podcast in podcasts_collection.find(
+        {"subscribers": {"$exists": True}}, projection={"subscribers":1}
+    ):
+        operations = [
+            UpdateOne(
+                {"podcast": podcast["_id"], "user": subscriber["user"]},
+                {"$setOnInsert": {
+                    "notification": subscriber.get("notification", False), "date": datetime.utcnow(),
+                }},
+                upsert=True,
+            )
+            for subscriber in podcast["subscribers"]
+        ]
+        if operations:
+            await subscriptions_collection.bulk_write(operations, ordered=False)
+        await podcasts_collection.update_one(
+            {"_id": podcast["_id"]},
+            {
+                "$set": {"subscriber_count": await subscriptions_collection.count_documents(
+                    {"podcast": podcast["_id"]}
+                )},
+                "$unset": {"subscribers": ""},
+            }
+        )
+    # both sides were written together, so podcasts hold every subscription
+    await users_collection.update_many({"subscriptions": {"$exists": True}}, {"$unset": {"subscriptions": ""}})
+
+
+if __name__ == "__main__":
+    import asyncio
+    asyncio.run(migrate_embedded_subscriptions())
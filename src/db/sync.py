@@ -0,0 +1,303 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from functools import partial
+from itertools import islice
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Container, Iterable, Iterator, NamedTuple
+
+from bson import ObjectId
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from config import SETTINGS
+from schemas import Episode, SyncStats
+from services import CatalogUnavailable
+from .likes import delete_episode_likes, delete_podcast_likes
+from .subscriptions import delete_podcast_subscriptions
+from .podcasts import invalidate_feeds, invalidate_podcast, invalidate_podcast_list, podcast_service, podcasts_collection
+
+
+
+logger = logging.getLogger(__name__)
+
+
+class _PodcastWrite(NamedTuple):
+    """Write operations of one podcast, flushed together by the writer"""
+    operations : list
+    episodes : int
+    podcast_id : ObjectId|None = None  # set for existing podcasts (to invalidate their cache)
+
+
+_Job = Callable[[], Awaitable[_PodcastWrite|None]]
+
+
+def podcast_fingerprint(podcast:dict) -> str:
+    """Version of a podcast in catalog list
+
+    Upstream `etag` or `updated_at` is used when given, otherwise a hash of the item.
+    """
+    version = podcast.get("etag") or podcast.get("updated_at")
+    if version is not None:
+        return str(version)
+    content = json.dumps(podcast, sort_keys=True, default=str)
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def build_episode_documents(episode_ids:Iterable) -> list[dict]:
+    return [Episode(api_identifier=episode_id).model_dump() for episode_id in episode_ids]
+
+
+async def update_db(progress:Callable[[SyncStats], Awaitable]|None=None) -> SyncStats:  #? make this a celery task? (Problems: 3.async db  2.Async api service)
+    """Synchronizes the internal database with the podcasts catalog
+
+    Only podcasts whose fingerprint (see `podcast_fingerprint`) changed since the last
+    sync have their episode lists fetched, so a sync without changes costs one catalog
+    list call and one query per `SETTINGS.SYNC_QUERY_CHUNK_SIZE` podcasts. Saved podcasts
+    are streamed from the cursors, so memory does not grow with the size of the database.
+
+    Args:
+    -----
+    - progress `(Callable)`: _coroutine function called with current stats after each written batch_
+
+    Returns:
+    --------
+    `SyncStats`: counters and throughput of this run
+    """
+    stats = SyncStats()
+    started = time.perf_counter()
+
+    # retrive podcast list
+    resp = await podcast_service.podcast_list(fresh=True)
+    if not resp:
+        raise CatalogUnavailable("catalog list failed")
+    fingerprints = {podcast["id"]: podcast_fingerprint(podcast) for podcast in resp.data["podcasts"]}
+
+    await run_pipeline(_sync_jobs(fingerprints, stats), stats, progress)
+    await remove_podcasts(fingerprints, stats)
+    if stats.podcasts or stats.removed:
+        await invalidate_podcast_list()
+        await invalidate_feeds()
+    # publish updated podcast data to rabbit (for `notification` micro-service)
+
+    stats.duration = time.perf_counter() - started
+    logger.info(
+        "catalog synced: %d podcasts (%.2f/s), %d episodes (%.2f/s), %d unchanged, %d removed, "
+        "%d failed in %.2fs",
+        stats.podcasts, stats.podcasts_per_second, stats.episodes, stats.episodes_per_second,
+        stats.unchanged, stats.removed, stats.failed, stats.duration,
+    )
+    return stats
+
+
+def chunked(iterable:Iterable, size:int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+async def _sync_jobs(fingerprints:dict, stats:SyncStats) -> AsyncIterator[_Job]:
+    """Yields a job for every new or changed podcast of the catalog"""
+    for chunk in chunked(fingerprints, SETTINGS.SYNC_QUERY_CHUNK_SIZE):
+        unsaved_ids = set(chunk)
+        db_podcasts = podcasts_collection.find(
+            {"api_identifier": {"$in": chunk}},
+            projection={"_id":1, "api_identifier":1, "fingerprint":1}
+        )
+        async for db_podcast in db_podcasts:
+            api_identifier = db_podcast["api_identifier"]
+            unsaved_ids.discard(api_identifier)
+            fingerprint = fingerprints[api_identifier]
+            if db_podcast.get("fingerprint") == fingerprint:
+                stats.unchanged += 1
+            else:
+                yield partial(_update_podcast, db_podcast["_id"], api_identifier, fingerprint)
+        for api_identifier in unsaved_ids:
+            yield partial(_create_podcast, api_identifier, fingerprints[api_identifier])
+
+
+async def remove_podcasts(catalog_ids:Container, stats:SyncStats):
+    """Deletes podcasts (with their episodes) that are not in the catalog anymore"""
+    if not catalog_ids:
+        # an empty catalog is far more likely an upstream failure than a real state
+        logger.warning("catalog is empty, skipped removing podcasts")
+        return
+    removed_ids = []
+    async for db_podcast in podcasts_collection.find(projection={"_id":1, "api_identifier":1}):
+        if db_podcast["api_identifier"] not in catalog_ids:
+            removed_ids.append(db_podcast["_id"])
+            if len(removed_ids) >= SETTINGS.SYNC_QUERY_CHUNK_SIZE:
+                await _delete_podcasts(removed_ids, stats)
+                removed_ids = []
+    if removed_ids:
+        await _delete_podcasts(removed_ids, stats)
+
+
+async def _delete_podcasts(podcast_ids:list[ObjectId], stats:SyncStats):
+    result = await podcasts_collection.delete_many({"_id": {"$in": podcast_ids}})
+    stats.removed += result.deleted_count
+    await delete_podcast_likes(*podcast_ids)
+    await delete_podcast_subscriptions(*podcast_ids)
+    await invalidate_podcast(*podcast_ids)
+
+
+
+async def _fetch_episode_ids(podcast_id) -> list|None:
+    try:
+        resp = await podcast_service.podcast_episode_list(podcast_id, fresh=True)
+    except Exception:
+        logger.exception("episode list request of podcast %s failed", podcast_id)
+        return None
+    if not resp:
+        logger.warning("could not retrieve episodes of podcast %s", podcast_id)
+        return None
+    return [episode["id"] for episode in resp.data["episodes"]]
+
+
+async def _create_podcast(api_identifier, fingerprint) -> _PodcastWrite|None:
+    episode_ids = await _fetch_episode_ids(api_identifier)
+    if episode_ids is None:
+        return None
+    document = {
+        "api_identifier": api_identifier,
+        "fingerprint": fingerprint,
+        "subscriber_count": 0,
+        "episodes": build_episode_documents(episode_ids),
+    }
+    return _PodcastWrite([InsertOne(document)], len(episode_ids))
+
+
+async def _update_podcast(podcast_id:ObjectId, api_identifier, fingerprint) -> _PodcastWrite|None:
+    episode_ids = await _fetch_episode_ids(api_identifier)
+    if episode_ids is None:
+        return None
+    db_podcast = await podcasts_collection.find_one(
+        {"_id": podcast_id}, projection={"_id":0, "episodes.api_identifier":1, "episodes.id":1}
+    )
+    saved_ids = {
+        episode["api_identifier"]: episode["id"] for episode in (db_podcast or {}).get("episodes", [])
+    }
+    new_ids = [episode_id for episode_id in episode_ids if episode_id not in saved_ids]
+    removed_ids = list(saved_ids.keys() - set(episode_ids))
+    if removed_ids:
+        await delete_episode_likes([saved_ids[episode_id] for episode_id in removed_ids])
+
+    operations = []
+    if removed_ids:
+        operations.append(UpdateOne(
+            {"_id": podcast_id},
+            {"$pull": {"episodes": {"api_identifier": {"$in": removed_ids}}}}
+        ))
+    update = {"$set": {"fingerprint": fingerprint}}
+    if new_ids:
+        update["$push"] = {"episodes": {"$each": build_episode_documents(new_ids)}}
+    operations.append(UpdateOne({"_id": podcast_id}, update))
+    return _PodcastWrite(operations, len(new_ids), podcast_id)
+
+
+
+async def run_pipeline(jobs:AsyncIterable[_Job], stats:SyncStats, progress=None):
+    """Runs podcast jobs concurrently and writes their operations in batches
+
+    Jobs (at most `SETTINGS.SYNC_CONCURRENCY` at a time, pulled from `jobs` only when
+    a slot is free) and the writer (one `bulk_write` per `SETTINGS.SYNC_BATCH_SIZE`
+    operations) run as a pipeline connected by a bounded queue, so a slow database
+    applies back pressure to the fetchers.
+
+    If the writer dies, the sync is stopped with its error (instead of jobs waiting
+    forever on the queue nobody consumes anymore).
+    """
+    queue = asyncio.Queue(maxsize=SETTINGS.SYNC_BATCH_SIZE * 2)
+    semaphore = asyncio.Semaphore(SETTINGS.SYNC_CONCURRENCY)
+    workers = set()
+    writer = asyncio.create_task(_write_batches(queue, stats, progress))
+
+    async def unless_writer_stopped(awaitable):
+        task = asyncio.ensure_future(awaitable)
+        await asyncio.wait({task, writer}, return_when=asyncio.FIRST_COMPLETED)
+        if not task.done():
+            task.cancel()
+            await writer  # re-raises the error of the writer
+            raise RuntimeError("sync writer stopped before the end of the sync")
+        return task.result()
+
+    async def run(job):
+        try:
+            try:
+                write = await job()
+            except Exception:
+                # finished workers are dropped from `workers`, so the error is handled here
+                logger.exception("sync job %r failed", job)
+                write = None
+            if write is None:
+                stats.failed += 1
+            else:
+                await unless_writer_stopped(queue.put(write))
+        finally:
+            semaphore.release()
+
+    try:
+        async for job in jobs:
+            await unless_writer_stopped(semaphore.acquire())
+            worker = asyncio.create_task(run(job))
+            workers.add(worker)
+            worker.add_done_callback(workers.discard)
+        await asyncio.gather(*workers)
+        await unless_writer_stopped(queue.put(None))
+        await writer
+    finally:
+        for task in (*workers, writer):
+            task.cancel()
+
+
+async def _write_batches(queue:asyncio.Queue, stats:SyncStats, progress=None):
+    batch = []
+    size = 0
+    while (write := await queue.get()) is not None:
+        batch.append(write)
+        size += len(write.operations)
+        if size >= SETTINGS.SYNC_BATCH_SIZE:
+            await _flush(batch, stats)
+            batch, size = [], 0
+            if progress:
+                try:
+                    await progress(stats)
+                except Exception:
+                    # a failed progress report must not stop the writer
+                    logger.exception("sync progress report failed")
+    if batch:
+        await _flush(batch, stats)
+
+
+async def _flush(batch:list[_PodcastWrite], stats:SyncStats):
+    operations = [operation for write in batch for operation in write.operations]
+    failed = set()
+    try:
+        await podcasts_collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        failed = {error["index"] for error in e.details["writeErrors"]}
+        logger.warning("%d operations of sync batch failed", len(failed))
+    except PyMongoError:
+        # the writer keeps going, so workers waiting on the queue are never stuck
+        logger.exception("sync batch of %d operations failed", len(operations))
+        failed = set(range(len(operations)))
+
+    start = 0
+    invalidated = []
+    for write in batch:
+        end = start + len(write.operations)
+        if failed.intersection(range(start, end)):
+            stats.failed += 1
+        else:
+            stats.podcasts += 1
+            stats.episodes += write.episodes
+            if write.podcast_id is not None:
+                invalidated.append(write.podcast_id)
+        start = end
+    if invalidated:
+        try:
+            await invalidate_podcast(*invalidated)
+        except Exception:
+            # the writer keeps going, cached responses of these podcasts expire with their ttl
+            logger.exception("invalidating cache of %d synced podcasts failed", len(invalidated))
@@ -1,17 +1,49 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 
 from config import SETTINGS
 from db import db
+from db.indexes import ensure_indexes
+from db.podcasts import like_buffer, podcast_service
+from db.scheduler import sync_scheduler
+from auth import session_cache
 
 from api import router
+from api.metrics import MetricsMiddleware, router as metrics_router
+from api.profiling import ProfilingMiddleware, router as profiling_router
+from services import metrics
+
 
 
 
+@asynccontextmanager
+async def lifespan(app:FastAPI):
+    await ensure_indexes()
+    await podcast_service.start()
+    await session_cache.start()
+    await sync_scheduler.start()
+    if SETTINGS.LIKES_WRITE_BEHIND:
+        await like_buffer.start()
+    yield
+    await like_buffer.stop()
+    await sync_scheduler.stop()
+    await session_cache.stop()
+    await podcast_service.aclose()
 
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(router)
+app.include_router(metrics_router)
+app.include_router(profiling_router)
+
+metrics.gauge(
+    "podcasts_api_pool", "Requests and connections of the catalog http client pool",
+    lambda: [((stat,), value) for stat,value in podcast_service.pool_stats().items()], ("stat",),
+)
 
 @app.get("/")
 async def index():
@@ -5,6 +5,8 @@ from pydantic import BaseModel,Field, field_serializer, field_validator
 
 from .base import *
 from .jwt import *
+from .sync import *
+from .interactions import *
 
 
 
@@ -51,43 +53,9 @@ class CommentStruct(BaseModel):
         return v
 
 
-class UserSubsStruct(BaseModel):
-    podcast : ObjectId
-    notification : bool
-    class Config:
-        arbitrary_types_allowed=True
-
-    @field_serializer('podcast')
-    def id_serializer(self, id, _info):
-        return str(id)
-
-    @field_validator("podcast")
-    def id_validator(cls, v):
-        if type(v) is str:
-            return ObjectId(v)
-        return v
-
-class PodcastSubsStruct(BaseModel):
-    user : ObjectId
-    notification : bool = False
-    class Config:
-        arbitrary_types_allowed=True
-
-    @field_serializer('user')
-    def id_serializer(self, id, _info):
-        return str(id)
-
-    @field_validator("user")
-    def id_validator(cls, v):
-        if type(v) is str:
-            return ObjectId(v)
-        return v
-
-
-
 class Episode(BaseModel):
     api_identifier : EPISODE_ID
-    likes : list[ObjectId] = []
+    likes_count : int = 0
     comments : list[CommentStruct] = []
     id : ObjectId|None = Field(default_factory=ObjectId)
 
@@ -104,15 +72,11 @@ class Episode(BaseModel):
             return ObjectId(v)
         return v
 
-    @field_serializer('likes')
-    def likes_serializer(self, likes, _info):
-        return list(map(lambda item:str(item), likes))
-
 
 
 class Podcast(MongoScheme):
     api_identifier : PODCAST_ID
-    subscribers : list[PodcastSubsStruct] = []
+    subscriber_count : int = 0
     episodes : list[Episode] = []
 
 
@@ -129,7 +93,6 @@ class UserLikeStruct(BaseModel):
 class User(MongoScheme):
     api_identifier : USER_ID
     liked_episodes : list[UserLikeStruct] = []
-    subscriptions : list[UserSubsStruct] = []
 
     @field_serializer('liked_episodes')
     def id_serializer(self, likes, _info):
@@ -0,0 +1,27 @@
+import orjson
+from bson import ObjectId
+
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    """Serializes raw Motor documents (`ObjectId`s, `datetime`s, ...) straight to JSON bytes"""
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+loads = orjson.loads
+
+
+def mongo_document(document:dict) -> dict:
+    """Document as it is served by the API (`_id` renamed to `id`), without model validation
+
+    The document must already be projected to the fields of the served schema.
+    """
+    if "_id" in document:
+        document["id"] = document.pop("_id")
+    return document
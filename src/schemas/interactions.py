@@ -0,0 +1,28 @@
+from typing import Literal
+
+from pydantic import BaseModel, Field, model_validator
+
+from config import SETTINGS
+
+
+
+class Interaction(BaseModel):
+    action : Literal["like", "unlike", "subscribe", "unsubscribe"]
+    podcast_id : str
+    episode_id : str|None = None
+
+    @model_validator(mode="after")
+    def episode_validator(self):
+        if self.action in ("like", "unlike") and not self.episode_id:
+            raise ValueError(f"`episode_id` is required for `{self.action}`")
+        return self
+
+
+class InteractionBatch(BaseModel):
+    operations : list[Interaction] = Field(min_length=1, max_length=SETTINGS.INTERACTIONS_BATCH_SIZE)
+
+
+class InteractionResult(BaseModel):
+    """Result of one operation, `status` is 201 (changed), 208 (already so) or 404"""
+    status : int
+    error : str|None = None
@@ -0,0 +1,22 @@
+from pydantic import BaseModel, computed_field
+
+
+
+class SyncStats(BaseModel):
+    """Counters of one `update_db` run"""
+    podcasts : int = 0
+    episodes : int = 0
+    unchanged : int = 0
+    removed : int = 0
+    failed : int = 0
+    duration : float = 0
+
+    @computed_field
+    @property
+    def podcasts_per_second(self) -> float:
+        return round(self.podcasts / self.duration, 2) if self.duration else 0
+
+    @computed_field
+    @property
+    def episodes_per_second(self) -> float:
+        return round(self.episodes / self.duration, 2) if self.duration else 0
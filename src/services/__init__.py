@@ -1,2 +1,4 @@
-from .podcast_api import PodcastAPIService
-from .redis import RedisService
\ No newline at end of file
+from .podcast_api import CatalogUnavailable, PodcastAPIService
+from .redis import LeaseLost, RedisService
+from .cache import CacheService
+from .metrics import metrics, observe, observed
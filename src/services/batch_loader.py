@@ -0,0 +1,85 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+from .metrics import metrics
+
+
+
+batch_sizes = metrics.histogram(
+    "batch_loader_batch_size", "Keys loaded by each call of batch loaders", ("loader",),
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250),
+)
+
+
+class BatchLoader:
+    """Collects single-key loads into batches (DataLoader style)
+
+    Keys requested within one event loop iteration (or `window` seconds, if given) are
+    loaded with one call of `batch`, and the result of each key is handed back to its
+    awaiters. A key requested again while it is pending shares the pending load. `batch`
+    may map a key to an exception, which is raised to the awaiters of that key only.
+
+    Usage:
+    ------
+    ```python
+    async def load_podcasts(ids:list) -> dict:
+        ...  # {id: podcast}, missing ids are resolved with None
+
+    loader = BatchLoader(load_podcasts, max_size=100)
+    podcasts = await asyncio.gather(*(loader.load(id) for id in ids))  # one `load_podcasts` call
+    ```
+    """
+    def __init__(self, batch:Callable[[list], Awaitable[dict]], max_size:int, window:float=0, name:str="batch"):
+        self.batch = batch
+        self.max_size = max_size
+        self.window = window
+        self.name = name  # label of the loader in `batch_sizes` metric
+        self._pending : dict[Hashable, asyncio.Future] = {}
+        self._handle : asyncio.Handle|None = None
+        self._batches : set[asyncio.Task] = set()
+
+    async def load(self, key:Hashable) -> Any:
+        future = self._pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._pending[key] = loop.create_future()
+            if len(self._pending) >= self.max_size:
+                self._dispatch()
+            elif self._handle is None:
+                if self.window:
+                    self._handle = loop.call_later(self.window, self._dispatch)
+                else:
+                    self._handle = loop.call_soon(self._dispatch)
+        # shielded so a cancelled caller does not cancel the result shared with others
+        return await asyncio.shield(future)
+
+    def _dispatch(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        futures, self._pending = self._pending, {}
+        if futures:
+            task = asyncio.create_task(self._run(futures))
+            # the event loop only keeps weak references of tasks
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _run(self, futures:dict[Hashable, asyncio.Future]):
+        batch_sizes.observe(len(futures), self.name)
+        try:
+            results = await self.batch(list(futures))
+        except Exception as e:
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(e)
+                    # marked as retrieved, awaiters of the key may all have been cancelled
+                    future.exception()
+            return
+        for key, future in futures.items():
+            if not future.done():
+                result = results.get(key)
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                    future.exception()
+                else:
+                    future.set_result(result)
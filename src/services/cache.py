@@ -0,0 +1,203 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Iterable
+
+from redis.exceptions import WatchError
+
+from config.settings import SETTINGS
+from schemas.encoding import dumps, loads
+from .metrics import cache_requests
+from .redis import RedisService
+
+
+
+_MISSING = object()
+
+
+class CacheService:
+    """Read-through cache of JSON payloads shared by all replicas through Redis
+
+    Every entry can be attached to some tags, so a whole group of entries (e.g. everything
+    built from one podcast) is dropped with a single `invalidate_tags` call. A value whose
+    load was running while one of its tags got invalidated is returned, but not cached.
+
+    Concurrent misses of one key are collapsed: inside a process all callers share one
+    loader task, and between replicas a short `SET NX` lock lets only one of them run the
+    loader while the others wait for the value to show up in Redis.
+
+    Usage:
+    ------
+    ```python
+    cache = CacheService()
+
+    data = await cache.get_or_load(
+        f"podcast:{id}", lambda: load_podcast(id), tags=[f"podcast:{id}"]
+    )
+    await cache.invalidate_tags(f"podcast:{id}")
+    ```
+    """
+    lock_ttl = 5               # seconds a replica may hold the loader lock of a key
+    lock_poll_interval = 0.05  # seconds between cache checks of replicas waiting for the lock
+
+    def __init__(self, redis:RedisService=None, prefix:str="cache"):
+        self.redis = redis or RedisService()
+        self.prefix = prefix
+        self._inflight : dict[str, asyncio.Task] = {}
+
+    def _key(self, key:str) -> str:
+        return f"{self.prefix}:{key}"
+
+    def _lock_key(self, key:str) -> str:
+        return f"{self.prefix}:lock:{key}"
+
+    def _tag_key(self, tag:str) -> str:
+        return f"{self.prefix}:tag:{tag}"
+
+    def _version_key(self, name:str) -> str:
+        return f"{self.prefix}:version:{name}"
+
+
+    async def get(self, key:str) -> Any:
+        cached = await self.redis.get(self._key(key))
+        return _MISSING if cached is None else loads(cached)
+
+    async def get_or_load(
+        self,
+        key:str,
+        loader:Callable[[], Awaitable[Any]],
+        ttl:int|None=None,
+        tags:Iterable[str]=(),
+    ) -> Any:
+        """Returns cached value of `key` or fills it with the result of `loader`
+
+        Args:
+        -----
+        - key `(str)`: _cache key (without prefix)_
+        - loader `(Callable)`: _coroutine function building the value on a miss_
+        - ttl `(int)`: _expiry of the entry in seconds (defaults to `SETTINGS.REDIS_KEY_TTL`)_
+        - tags `(Iterable[str])`: _tags this entry is invalidated with_
+
+        Returns:
+        --------
+        `Any`: the (JSON decoded) value. `None` results of loader are returned but not cached
+        """
+        value = await self.get(key)
+        if value is not _MISSING:
+            cache_requests.inc(self.prefix, "hit")
+            return value
+        cache_requests.inc(self.prefix, "miss")
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._load(key, loader, ttl, tuple(tags)))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shielded so a cancelled caller does not cancel the load shared with others
+        return await asyncio.shield(task)
+
+    async def _load(self, key, loader, ttl, tags):
+        lock_key = self._lock_key(key)
+        locked = await self.redis.set(lock_key, "1", ttl=self.lock_ttl, nx=True)
+        if not locked:
+            value = await self._wait_for(key)
+            if value is not _MISSING:
+                return value
+        try:
+            # versions of the tags (see `invalidate_tags`) before loading, an invalidation
+            # while the loader runs means its value may be outdated already
+            versions = await self._tag_versions(tags)
+            value = await loader()
+            if value is not None:
+                await self._set_unless_invalidated(key, value, ttl, tags, versions)
+            return value
+        finally:
+            if locked:
+                await self.redis.delete(lock_key)
+
+    async def _wait_for(self, key):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.lock_ttl
+        while loop.time() < deadline:
+            await asyncio.sleep(self.lock_poll_interval)
+            value = await self.get(key)
+            if value is not _MISSING:
+                return value
+        return _MISSING
+
+
+    async def _tag_versions(self, tags) -> list:
+        if not tags:
+            return []
+        return await self.redis.mget(*(self._version_key(tag) for tag in tags))
+
+    async def _set_unless_invalidated(self, key, value, ttl, tags, versions):
+        if not tags:
+            return await self.set(key, value, ttl)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            version_keys = [self._version_key(tag) for tag in tags]
+            # the SET is aborted if a tag is invalidated between this check and it
+            await pipe.watch(*version_keys)
+            current = [version.decode() if version else None for version in await pipe.mget(version_keys)]
+            if current != versions:
+                return
+            pipe.multi()
+            self._queue_set(pipe, key, value, ttl, tags)
+            try:
+                await pipe.execute()
+            except WatchError:
+                pass
+
+    async def set(self, key:str, value:Any, ttl:int|None=None, tags:Iterable[str]=()):
+        pipe = self.redis.pipeline()
+        self._queue_set(pipe, key, value, ttl, tags)
+        await pipe.execute()
+
+    def _queue_set(self, pipe, key, value, ttl, tags):
+        ttl = ttl or SETTINGS.REDIS_KEY_TTL
+        full_key = self._key(key)
+        pipe.set(full_key, dumps(value), ex=ttl)
+        for tag in tags:
+            tag_key = self._tag_key(tag)
+            pipe.sadd(tag_key, full_key)
+            pipe.expire(tag_key, ttl)
+
+    async def invalidate(self, *keys:str):
+        if keys:
+            await self.redis.delete(*map(self._key, keys))
+
+    async def invalidate_tags(self, *tags:str):
+        """Drops every entry attached to any of the given tags and bumps their versions
+
+        The versions are bumped before the entries are dropped, so loads that started
+        before are not cached, and again after, so an entry read in between is never
+        served under the final version.
+        """
+        await self.bump(*tags)
+        for tag in tags:
+            tag_key = self._tag_key(tag)
+            keys = await self.redis.smembers(tag_key)
+            await self.redis.delete(tag_key, *keys)
+        await self.bump(*tags)
+
+
+    async def version(self, name:str) -> int:
+        """Current version of a resource (see `bump`)
+
+        Versions never expire. A missing one (e.g. Redis was flushed) starts from the
+        current time, so versions handed out before are not given to different data.
+        """
+        version = await self.redis.get(self._version_key(name))
+        if version is None:
+            pipe = self.redis.pipeline()
+            pipe.set(self._version_key(name), time.time_ns(), nx=True)
+            pipe.get(self._version_key(name))
+            _, version = await pipe.execute()
+        return int(version)
+
+    async def bump(self, *names:str):
+        """Changes the version of the given resources"""
+        if names:
+            pipe = self.redis.pipeline()
+            for name in names:
+                pipe.set(self._version_key(name), time.time_ns(), nx=True)
+                pipe.incr(self._version_key(name))
+            await pipe.execute()
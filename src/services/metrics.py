@@ -0,0 +1,266 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Iterable
+
+from pymongo import monitoring
+
+
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(names:tuple, values:tuple, extra:str="") -> str:
+    pairs = [f'{name}="{str(value)}"' for name,value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name:str, help:str, labels:tuple[str, ...]=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values : dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount:float=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self) -> Iterable[str]:
+        for label_values, value in list(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name:str, help:str, labels:tuple[str, ...]=(), buckets:tuple=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # label values -> [count of each bucket (not cumulative) + overflow, sum]
+        self._values : dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value:float, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                counts = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def render(self) -> Iterable[str]:
+        for label_values, counts in list(self._values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, f'le="{bound}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {counts[-1]}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Gauge:
+    """Gauge computed on scrape by `collect` (returns `(label values, value)` pairs)"""
+    type = "gauge"
+
+    def __init__(self, name:str, help:str, collect:Callable[[], Iterable[tuple[tuple, float]]], labels:tuple[str, ...]=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.collect = collect
+
+    def render(self) -> Iterable[str]:
+        for label_values, value in self.collect():
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+
+
+
+class Metrics:
+    """Registry of in-process metrics, rendered in Prometheus text format
+
+    Metrics are aggregated in memory of each process (no client library, no push), so
+    recording one costs a dict lookup and an addition.
+
+    Usage:
+    ------
+    ```python
+    with observe("redis", "get"):
+        ...
+
+    cache_requests.inc("response", "hit")
+    metrics.render()   # body of `GET /metrics`
+    ```
+    """
+    def __init__(self):
+        self._metrics : dict[str, Counter|Histogram|Gauge] = {}
+
+    def _register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name:str, help:str, labels:tuple[str, ...]=()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def histogram(self, name:str, help:str, labels:tuple[str, ...]=(), buckets:tuple=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name:str, help:str, collect:Callable, labels:tuple[str, ...]=()) -> Gauge:
+        return self._register(Gauge(name, help, collect, labels))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+request_latency = metrics.histogram(
+    "http_request_duration_seconds", "Latency of HTTP requests", ("method", "route", "status")
+)
+request_errors = metrics.counter(
+    "http_request_errors_total", "HTTP requests answered with a 5xx status", ("method", "route")
+)
+backend_latency = metrics.histogram(
+    "backend_operation_duration_seconds", "Latency of backend (mongo, redis, catalog, auth) operations",
+    ("backend", "operation"),
+)
+backend_errors = metrics.counter(
+    "backend_operation_errors_total", "Backend operations that raised an error", ("backend", "operation")
+)
+cache_requests = metrics.counter(
+    "cache_requests_total", "Lookups of caches by result (hit/miss)", ("cache", "result")
+)
+
+
+class IOBreakdown:
+    """Time spent waiting for each backend operation during one (profiled) request"""
+    def __init__(self):
+        self.operations : dict[str, list] = {}  # "backend.operation" -> [calls, seconds]
+        self._lock = threading.Lock()  # mongo operations are recorded from worker threads
+
+    def add(self, backend:str, operation:str, seconds:float):
+        key = f"{backend}.{operation}"
+        with self._lock:
+            entry = self.operations.setdefault(key, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def summary(self) -> dict:
+        backends = {}
+        for key, (calls, seconds) in self.operations.items():
+            backend = backends.setdefault(key.split(".", 1)[0], {"calls": 0, "seconds": 0.0})
+            backend["calls"] += calls
+            backend["seconds"] += seconds
+        return {
+            "backends": backends,
+            "operations": {key: {"calls": calls, "seconds": seconds} for key,(calls, seconds) in self.operations.items()},
+        }
+
+# set only while a request is profiled (see `api.profiling`)
+io_breakdown : ContextVar[IOBreakdown|None] = ContextVar("io_breakdown", default=None)
+
+
+@contextmanager
+def observe(backend:str, operation:str):
+    """Records latency (and error) of the wrapped block as a backend operation"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        backend_errors.inc(backend, operation)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        backend_latency.observe(elapsed, backend, operation)
+        breakdown = io_breakdown.get()
+        if breakdown is not None:
+            breakdown.add(backend, operation, elapsed)
+
+
+def observed(backend:str, operation:str|None=None):
+    """Decorator version of `observe` for coroutine functions (operation defaults to function name)"""
+    def decorator(func):
+        name = operation or func.__name__
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with observe(backend, name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+
+class MongoListener(monitoring.CommandListener, monitoring.ConnectionPoolListener):
+    """Records latency/errors of every Mongo command and usage of the connection pools
+
+    Motor runs pymongo in worker threads, so these are called outside of the event loop
+    (but in a copy of the context of the calling task).
+    """
+    def __init__(self):
+        self.connections = 0
+        self.checked_out = 0
+        self._lock = threading.Lock()
+        metrics.gauge(
+            "mongo_pool_connections", "Connections of Mongo pools by state",
+            lambda: [(("open",), self.connections), (("in_use",), self.checked_out)], ("state",),
+        )
+
+    def started(self, event):
+        pass
+
+    def _observe(self, event):
+        backend_latency.observe(event.duration_micros / 1e6, "mongo", event.command_name)
+        breakdown = io_breakdown.get()
+        if breakdown is not None:
+            breakdown.add("mongo", event.command_name, event.duration_micros / 1e6)
+
+    def succeeded(self, event):
+        self._observe(event)
+
+    def failed(self, event):
+        self._observe(event)
+        backend_errors.inc("mongo", event.command_name)
+
+    def _add(self, attribute:str, amount:int):
+        with self._lock:
+            setattr(self, attribute, getattr(self, attribute) + amount)
+
+    def connection_created(self, event):
+        self._add("connections", 1)
+
+    def connection_closed(self, event):
+        self._add("connections", -1)
+
+    def connection_checked_out(self, event):
+        self._add("checked_out", 1)
+
+    def connection_checked_in(self, event):
+        self._add("checked_out", -1)
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_check_out_started(self, event): pass
+    def connection_check_out_failed(self, event): pass
@@ -1,6 +1,29 @@
+import asyncio
+import logging
+import time
+
 import httpx
 
-from schemas import Result
+from config.settings import SETTINGS
+from schemas import Error, Result
+from .batch_loader import BatchLoader
+from .metrics import metrics, observed
+from .resilience import CircuitBreaker, LatencyWindow, TokenBucket
+from .stale_cache import StaleCache
+
+
+
+logger = logging.getLogger(__name__)
+
+class CatalogUnavailable(Exception):
+    """The catalog failed to answer (error, 5xx or open circuit), unlike a 4xx answer"""
+
+
+hedged_requests = metrics.counter(
+    "podcasts_api_hedged_requests_total",
+    "Catalog requests sent twice, by result (fired/won by the second one/skipped for lack of budget)",
+    ("result",),
+)
 
 
 
@@ -23,11 +46,13 @@ episode_list = {
             "id": 2,
             "title": "ep1",
             "duration": 120,
+            "published": "2024-01-02T08:00:00",
         },
         {
             "id": 3,
             "title": "ep2",
             "duration": 53,
+            "published": "2024-01-09T08:00:00",
         }
     ],
     2:[
@@ -35,11 +60,13 @@ episode_list = {
             "id": 4,
             "title": "2ep1",
             "duration": 987,
+            "published": "2024-01-05T18:30:00",
         },
         {
             "id": 5,
             "title": "2ep2",
             "duration": 4555,
+            "published": "2024-01-12T18:30:00",
         }
     ]
 }
@@ -48,15 +75,114 @@ episode_list = {
 
 
 class PodcastAPIService:
+    """Client of the podcasts catalog service
+
+    One pooled `httpx.AsyncClient` is kept for the whole lifetime of the service, so
+    upstream calls reuse warm (keep-alive) connections. `start`/`aclose` are meant to be
+    called from the app lifespan; the client is also created lazily on first request.
+
+    Successful responses are cached in process (`StaleCache`) for a TTL of each method
+    (`SETTINGS.PODCASTS_*_TTL`) and served stale while they are refreshed, concurrent
+    calls of one url share a single upstream request. `fresh=True` skips cached responses.
+
+    Podcast details lookups made together (within one event loop iteration) are batched
+    into one request to `SETTINGS.PODCASTS_BATCH_PATH`, or bounded concurrent requests if
+    the catalog has no batch endpoint.
+
+    A GET still unanswered after the `SETTINGS.PODCASTS_HEDGE_PERCENTILE` latency is sent
+    again (hedged) and the first answer is used, for at most `SETTINGS.PODCASTS_HEDGE_BUDGET`
+    of the requests. When too many requests fail, a circuit
+    breaker fails them fast for a while (cached responses are served meanwhile, even
+    stale ones).
+
+    While `base_url` is empty, the bundled sample catalog is served instead.
+    """
     def __init__(self, accounts_url, http_client=None):
         self.base_url = accounts_url
-        self.http_client = http_client or httpx.AsyncClient()
+        self.http_client = http_client
+        self._owns_client = http_client is None
+        self.cache = StaleCache(SETTINGS.PODCASTS_CACHE_SIZE, SETTINGS.PODCASTS_STALE_TTL, name="podcasts_api")
+        self.details_loader = BatchLoader(
+            self._load_podcasts_details, SETTINGS.PODCASTS_BATCH_SIZE, SETTINGS.PODCASTS_BATCH_WINDOW,
+            name="podcast_details",
+        )
+        self.latencies = LatencyWindow(SETTINGS.PODCASTS_HEDGE_WINDOW)
+        self.hedge_budget = TokenBucket(SETTINGS.PODCASTS_HEDGE_BUDGET, burst=10)
+        self.breaker = CircuitBreaker(
+            "podcasts_api",
+            window = SETTINGS.PODCASTS_BREAKER_WINDOW,
+            error_rate = SETTINGS.PODCASTS_BREAKER_ERROR_RATE,
+            min_calls = SETTINGS.PODCASTS_BREAKER_MIN_CALLS,
+            cooldown = SETTINGS.PODCASTS_BREAKER_COOLDOWN,
+        )
+        self._requests = 0
+        self._in_flight = 0
+
+    def _create_client(self) -> httpx.AsyncClient:
+        http2 = SETTINGS.PODCASTS_HTTP2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("`h2` package is not installed, falling back to HTTP/1.1")
+                http2 = False
+        return httpx.AsyncClient(
+            http2 = http2,
+            limits = httpx.Limits(
+                max_connections = SETTINGS.PODCASTS_MAX_CONNECTIONS,
+                max_keepalive_connections = SETTINGS.PODCASTS_MAX_KEEPALIVE,
+                keepalive_expiry = SETTINGS.PODCASTS_KEEPALIVE_EXPIRY,
+            ),
+            timeout = httpx.Timeout(
+                SETTINGS.PODCASTS_TIMEOUT, connect=SETTINGS.PODCASTS_CONNECT_TIMEOUT
+            ),
+        )
 
-    async def __del__(self):  #!? Does this (async destructor) work?
-        await self.http_client.aclose()  #!
+    async def start(self):
+        if self.http_client is None:
+            self.http_client = self._create_client()
 
+    async def aclose(self):
+        if (self.http_client is not None) and self._owns_client:
+            await self.http_client.aclose()
+            self.http_client = None
 
-    async def podcast_list(self):
+    def pool_stats(self) -> dict:
+        """Usage of the connection pool of the http client
+
+        Connection counts are read from httpx internals (there is no public API for them),
+        they are left out when those are not available (e.g. another httpx version).
+
+        Returns:
+        --------
+        `dict`: total/in-flight request counts and (if known) open/idle/active connection counts
+        """
+        stats = {
+            "requests": self._requests,
+            "in_flight": self._in_flight,
+            "max_connections": SETTINGS.PODCASTS_MAX_CONNECTIONS,
+        }
+        connections = self._pool_connections()
+        if connections is not None:
+            stats["connections"] = len(connections)
+            stats["idle"] = sum(1 for connection in connections if connection.is_idle())
+            stats["active"] = stats["connections"] - stats["idle"]
+        return stats
+
+    def _pool_connections(self) -> list|None:
+        transport = getattr(self.http_client, "_transport", None)
+        connections = getattr(getattr(transport, "_pool", None), "connections", None)
+        try:
+            connections = list(connections)
+        except TypeError:
+            return None
+        if not all(callable(getattr(connection, "is_idle", None)) for connection in connections):
+            return None
+        return connections
+
+
+    @observed("podcasts_api")
+    async def podcast_list(self, fresh:bool=False):
         """
         NOTE: with considering response will be:
             resp = [
@@ -66,13 +192,12 @@ class PodcastAPIService:
             ]
         we do not need to change the response, so we return it directly
         """
-        # status_code,resp = await self._request("podcasts")
-        status_code = 200
-        resp = podcast_list
+        status_code,resp = await self._get("podcasts", lambda: podcast_list, SETTINGS.PODCASTS_LIST_TTL, fresh)
         if status_code == 200:
             return Result(True, podcasts=resp)
 
-    async def podcast_details(self, identifier):
+    @observed("podcasts_api")
+    async def podcast_details(self, identifier, fresh:bool=False):
         """
         NOTE: with considering response will be:
             resp = {
@@ -80,13 +205,15 @@ class PodcastAPIService:
             }
         we do not need to change the response, so we return it directly
         """
-        # status_code,resp = await self._request("podcasts")
-        status_code = 200
-        resp = podcast_list[0]
+        status_code,resp = await self._get(
+            f"podcasts/{identifier}", lambda: podcast_list[0], SETTINGS.PODCASTS_DETAILS_TTL, fresh,
+            fetch=lambda: self.details_loader.load(identifier),
+        )
         if status_code == 200:
             return Result(True, podcast=resp)
 
-    async def podcast_episode_list(self, podcast_identifier):
+    @observed("podcasts_api")
+    async def podcast_episode_list(self, podcast_identifier, fresh:bool=False):
         """
         NOTE: with considering response will be:
             resp =[
@@ -98,13 +225,15 @@ class PodcastAPIService:
             ]
         we do not need to change the response, so we return it directly
         """
-        # status_code,resp = await self._request("podcasts")
-        status_code = 200
-        resp = episode_list[podcast_identifier]
+        status_code,resp = await self._get(
+            f"podcasts/{podcast_identifier}/episodes", lambda: episode_list[podcast_identifier],
+            SETTINGS.PODCASTS_EPISODES_TTL, fresh,
+        )
         if status_code == 200:
             return Result(True, episodes=resp)
 
-    async def podcast_episode_details(self,podcast_identifier,episode_identifier):
+    @observed("podcasts_api")
+    async def podcast_episode_details(self,podcast_identifier,episode_identifier, fresh:bool=False):
         """
         NOTE: with considering response will be:
             resp = {
@@ -113,10 +242,13 @@ class PodcastAPIService:
             }
         we do not need to change the response, so we return it directly
         """
-        # status_code,resp = await self._request("podcasts")
-        status_code = 200
-        resp = [episode for episode in episode_list[podcast_identifier] if episode["id"]==episode_identifier][0]
-
+        status_code,resp = await self._get(
+            f"podcasts/{podcast_identifier}/episodes/{episode_identifier}",
+            lambda: [
+                episode for episode in episode_list[podcast_identifier] if episode["id"]==episode_identifier
+            ][0],
+            SETTINGS.PODCASTS_EPISODE_TTL, fresh,
+        )
         if status_code == 200:
             return Result(True, episode=resp)
 
@@ -125,16 +257,120 @@ class PodcastAPIService:
 
 
 
-    async def _request(self, url, data:dict=None) -> tuple[int, dict]:
+    async def _get(self, url, sample, ttl:float=0, fresh:bool=False, fetch=None) -> tuple[int, dict]:
+        if not self.base_url:
+            return 200, sample()
+        fetch = fetch or (lambda: self._fetch(url))
+        try:
+            resp = (await self.cache.get_or_load(url, fetch, ttl, fresh)) if ttl else (await fetch())
+        except CatalogUnavailable:
+            return 500, None
+        if resp is None:
+            return 500, None
+        return 200, resp
+
+    async def _fetch(self, url) -> dict|None:
+        """Data of a successful response, None for a 4xx (e.g. deleted upstream)
+
+        Raises:
+        -------
+        CatalogUnavailable: when the catalog failed, so a cached value may be served instead
+        """
+        status_code,resp = await self._request(url)
+        if status_code == 200:
+            return resp
+        if 400 <= status_code < 500:
+            return None
+        raise CatalogUnavailable(f"`{url}` answered with {status_code}")
+
+    async def _load_podcasts_details(self, identifiers:list) -> dict:
+        """Details of the podcasts by identifier (None for unknown ones, `CatalogUnavailable` for failed ones)"""
+        if SETTINGS.PODCASTS_BATCH_PATH:
+            status_code,resp = await self._request(SETTINGS.PODCASTS_BATCH_PATH, {"ids": identifiers})
+            if status_code == 200:
+                return {podcast["id"]: podcast for podcast in resp}
+            logger.warning("batch details request failed (%s), requesting podcasts one by one", status_code)
+        semaphore = asyncio.Semaphore(SETTINGS.PODCASTS_BATCH_CONCURRENCY)
+        async def fetch(identifier):
+            async with semaphore:
+                return await self._fetch(f"podcasts/{identifier}")
+        return dict(zip(identifiers, await asyncio.gather(*map(fetch, identifiers), return_exceptions=True)))
+
+    async def _request(self, url, data:dict=None, timeout:float|None=None) -> tuple[int, dict]:
         requested_url = f"{self.base_url}/{url}/"
+        if self.http_client is None:
+            await self.start()
+        if not self.breaker.allow():
+            return 503,Result(False, error=Error(type="CircuitOpen", message="podcasts service is unavailable"))
+        timeout = httpx.USE_CLIENT_DEFAULT if timeout is None else timeout
+        self._requests += 1
+        self._in_flight += 1
         try:
-            async with self.http_client as client:
-                if data:
-                    response = await client.post(requested_url, json=data)
-                else:
-                    response = await client.get(requested_url)
-            return response.status_code,response.json()
+            if data:
+                status_code,resp = await self._send(requested_url, data, timeout)
+            else:
+                status_code,resp = await self._hedged(requested_url, timeout)
         except Exception as e:
+            self.breaker.record(False)
             res = Result.resolve_exception(e)
             res.status = None
             return 500,res
+        except BaseException:
+            # cancelled, there is no outcome (but a half-open breaker must not wait for it forever)
+            self.breaker.abandon()
+            raise
+        finally:
+            self._in_flight -= 1
+        self.breaker.record(status_code < 500)
+        return status_code,resp
+
+    async def _send(self, url, data, timeout) -> tuple[int, dict]:
+        started = time.perf_counter()
+        if data:
+            response = await self.http_client.post(url, json=data, timeout=timeout)
+        else:
+            response = await self.http_client.get(url, timeout=timeout)
+        result = response.status_code,response.json()
+        self.latencies.add(time.perf_counter() - started)
+        return result
+
+    async def _hedged(self, url, timeout) -> tuple[int, dict]:
+        """Sends the GET again if it takes longer than the hedging percentile, the first
+        successful answer of the two is returned
+        """
+        started = time.perf_counter()
+        primary = asyncio.create_task(self._send(url, None, timeout))
+        hedge = None
+        self.hedge_budget.deposit()
+        delay = None
+        if SETTINGS.PODCASTS_HEDGE_PERCENTILE:
+            delay = self.latencies.percentile(SETTINGS.PODCASTS_HEDGE_PERCENTILE)
+        try:
+            if delay is None:
+                return await primary
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+            if not self.hedge_budget.withdraw():
+                # the catalog is slow across the board, hedging would only double its load
+                hedged_requests.inc("skipped")
+                return await primary
+            hedged_requests.inc("fired")
+            hedge = asyncio.create_task(self._send(url, None, timeout))
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if (task.exception() is None) and (task.result()[0] < 500):
+                        if task is hedge:
+                            hedged_requests.inc("won")
+                        return task.result()
+            # both failed, the first request decides
+            return primary.result()
+        finally:
+            if not primary.done():
+                # lost to the hedge, its latency (at least this long) still belongs to the percentile
+                self.latencies.add(time.perf_counter() - started)
+            for task in (primary, hedge):
+                if task is not None:
+                    task.cancel()
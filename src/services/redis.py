@@ -1,8 +1,22 @@
+import asyncio
+import logging
+from typing import Any, Awaitable
+from weakref import WeakSet
+
 from redis import asyncio as aioredis
+from redis.exceptions import LockError
 
 from config.settings import SETTINGS
+from .metrics import metrics, observed
+
+
+
+logger = logging.getLogger(__name__)
 
 
+class LeaseLost(LockError):
+    """Raised by `RedisService.run_with_lease` when the lease was lost (or ran out of time)"""
+
 
 class RedisService:
     def __init__(self, url:str=None, **kwargs) -> None:
@@ -12,24 +26,135 @@ class RedisService:
             url (str): url of redis instance (requires complete url containing auth and db (if needed))
         """
         self.client = aioredis.from_url(url or SETTINGS.REDIS_URL, **kwargs)
+        _services.add(self)
+
+    def pool_stats(self) -> dict:
+        pool = self.client.connection_pool
+        idle = len(getattr(pool, "_available_connections", ()))
+        in_use = len(getattr(pool, "_in_use_connections", ()))
+        return {"open": idle + in_use, "in_use": in_use}
 
 
-    async def set(self, key:str, value:str, ttl:int|None=None):
-        await self.client.set(
+    @observed("redis")
+    async def set(self, key:str, value:str, ttl:int|None=None, nx:bool=False):
+        return await self.client.set(
             name = key,
             value = value,
-            ex = ttl or SETTINGS.REDIS_KEY_TTL
+            ex = ttl or SETTINGS.REDIS_KEY_TTL,
+            nx = nx,
         )
 
+    @observed("redis")
     async def get(self, key:str):
         result = await self.client.get(key)
         return result.decode() if result else None
 
+    @observed("redis")
+    async def mget(self, *keys:str) -> list:
+        return [result.decode() if result else None for result in await self.client.mget(keys)]
+
+    @observed("redis")
     async def keys(self, pattern:str):
         return await self.client.keys(pattern)
 
     async def new_client(self, url):
         self.clinet = aioredis.from_url(url or SETTINGS.REDIS_URL)
 
+    @observed("redis")
     async def delete(self, *keys):
         return await self.client.delete(*keys)
+
+    @observed("redis")
+    async def smembers(self, key:str):
+        return {member.decode() for member in await self.client.smembers(key)}
+
+    @observed("redis")
+    async def sadd(self, key:str, *members:str):
+        return await self.client.sadd(key, *members)
+
+    @observed("redis")
+    async def srem(self, key:str, *members:str):
+        return await self.client.srem(key, *members)
+
+    @observed("redis")
+    async def hset(self, key:str, mapping:dict, ttl:int|None=None):
+        pipe = self.pipeline()
+        pipe.hset(key, mapping=mapping)
+        pipe.expire(key, ttl or SETTINGS.REDIS_KEY_TTL)
+        await pipe.execute()
+
+    @observed("redis")
+    async def hgetall(self, key:str) -> dict:
+        result = await self.client.hgetall(key)
+        return {field.decode(): value.decode() for field,value in result.items()}
+
+    @observed("redis")
+    async def rpush(self, key:str, *values:str):
+        return await self.client.rpush(key, *values)
+
+    @observed("redis")
+    async def lpop(self, key:str):
+        result = await self.client.lpop(key)
+        return result.decode() if result else None
+
+    def lock(self, name:str, ttl:float):
+        """Lease lock with `ttl` seconds timeout (see `redis.asyncio.lock.Lock`)"""
+        return self.client.lock(name, timeout=ttl)
+
+    async def run_with_lease(self, lock, awaitable:Awaitable, max_duration:float|None=None) -> Any:
+        """Runs `awaitable` while renewing the (acquired) lease `lock`, returns its result
+
+        The lease is renewed every third of its ttl. When it is lost, or `awaitable` ran for
+        `max_duration` seconds, `awaitable` is cancelled (so two holders never run at once)
+        and `LeaseLost` is raised. The lock is not released.
+        """
+        task = asyncio.ensure_future(awaitable)
+        keeper = asyncio.create_task(_keep_lease(lock, max_duration))
+        try:
+            await asyncio.wait({task, keeper}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            keeper.cancel()
+            task.cancel()  # no-op when finished
+            await asyncio.wait({task})
+        if task.cancelled() and keeper.done() and not keeper.cancelled():
+            raise LeaseLost(keeper.result())
+        return task.result()
+
+    @observed("redis")
+    async def publish(self, channel:str, message:str):
+        return await self.client.publish(channel, message)
+
+    def pubsub(self):
+        return self.client.pubsub(ignore_subscribe_messages=True)
+
+    def pipeline(self, transaction:bool=False):
+        return self.client.pipeline(transaction=transaction)
+
+
+
+async def _keep_lease(lock, max_duration:float|None) -> str:
+    """Renews the lease, returns (with the reason) once it is lost or `max_duration` passed"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max_duration if max_duration else float("inf")
+    while True:
+        await asyncio.sleep(min(lock.timeout / 3, max(deadline - loop.time(), 0)))
+        if loop.time() >= deadline:
+            logger.error("lease %s was held longer than %s seconds", lock.name, max_duration)
+            return "timed out"
+        try:
+            await lock.reacquire()
+        except LockError:
+            logger.error("lease %s was lost", lock.name)
+            return f"lost the lease {lock.name}"
+
+
+_services : WeakSet[RedisService] = WeakSet()
+
+def _pool_usage():
+    totals = {"open": 0, "in_use": 0}
+    for service in list(_services):
+        for state, count in service.pool_stats().items():
+            totals[state] += count
+    return [((state,), count) for state,count in totals.items()]
+
+metrics.gauge("redis_pool_connections", "Connections of Redis pools by state", _pool_usage, ("state",))
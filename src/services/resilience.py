@@ -0,0 +1,146 @@
+import time
+from collections import deque
+from weakref import WeakSet
+
+from .metrics import metrics
+
+
+
+breaker_transitions = metrics.counter(
+    "circuit_breaker_transitions_total", "State changes of circuit breakers", ("breaker", "state")
+)
+breaker_rejections = metrics.counter(
+    "circuit_breaker_rejections_total", "Calls failed fast by open circuit breakers", ("breaker",)
+)
+
+
+class CircuitBreaker:
+    """Fails calls fast while an upstream keeps failing
+
+    The breaker opens when at least `error_rate` of the last `window` calls failed (and
+    at least `min_calls` were made). After `cooldown` seconds it lets a single probe call
+    through (half-open): its success closes the breaker, its failure opens it again.
+
+    Usage:
+    ------
+    ```python
+    breaker = CircuitBreaker("catalog", window=50, error_rate=0.5, min_calls=20, cooldown=30)
+    if not breaker.allow():
+        ...  # fail fast
+    try:
+        ok = ...  # make the call
+    except asyncio.CancelledError:
+        breaker.abandon()
+        raise
+    breaker.record(ok)
+    ```
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name:str, window:int, error_rate:float, min_calls:int, cooldown:float):
+        self.name = name
+        self.error_rate = error_rate  # 0 disables the breaker
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self._results : deque[bool] = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probing = False
+        _breakers.add(self)
+
+    def allow(self) -> bool:
+        """Checks if a call may be made now (counts the rejections)"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.cooldown:
+                breaker_rejections.inc(self.name)
+                return False
+            self._set(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                breaker_rejections.inc(self.name)
+                return False
+            self._probing = True
+        return True
+
+    def record(self, success:bool):
+        """Records the result of a call allowed by `allow`"""
+        if self.state == self.HALF_OPEN:
+            self._probing = False
+            if success:
+                self._results.clear()
+                self._set(self.CLOSED)
+            else:
+                self._open()
+            return
+        self._results.append(success)
+        if (self.error_rate > 0) and (self.state == self.CLOSED) and (len(self._results) >= self.min_calls):
+            if self._results.count(False) / len(self._results) >= self.error_rate:
+                self._open()
+
+    def abandon(self):
+        """Releases a call allowed by `allow` that ended without an outcome (e.g. cancelled)"""
+        if self.state == self.HALF_OPEN:
+            # the probe slot is freed, so the next call probes instead of being rejected forever
+            self._probing = False
+
+    def _open(self):
+        self._opened_at = time.monotonic()
+        self._set(self.OPEN)
+
+    def _set(self, state:str):
+        self.state = state
+        breaker_transitions.inc(self.name, state)
+
+
+_breakers : WeakSet[CircuitBreaker] = WeakSet()
+
+metrics.gauge(
+    "circuit_breaker_open", "State of circuit breakers (0 closed, 0.5 half-open, 1 open)",
+    lambda: [
+        ((breaker.name,), {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 0.5, CircuitBreaker.OPEN: 1}[breaker.state])
+        for breaker in list(_breakers)
+    ],
+    ("breaker",),
+)
+
+
+
+class LatencyWindow:
+    """Latencies of the last `size` calls, to derive percentiles (e.g. hedging delays) from"""
+    def __init__(self, size:int, min_samples:int=20):
+        self.min_samples = min_samples
+        self._samples : deque[float] = deque(maxlen=size)
+
+    def add(self, seconds:float):
+        self._samples.append(seconds)
+
+    def percentile(self, percent:float) -> float|None:
+        """`percent` percentile of the window, None until `min_samples` latencies are known"""
+        if len(self._samples) < self.min_samples:
+            return None
+        samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(len(samples) * percent / 100))]
+
+
+
+class TokenBucket:
+    """Budget of an extra action earned by regular ones (e.g. hedges earned by requests)
+
+    Every `deposit` adds `ratio` tokens (up to `burst`), every granted `withdraw` takes one,
+    so the extra actions stay below `ratio` of the regular ones (plus `burst`).
+    """
+    def __init__(self, ratio:float, burst:float):
+        self.ratio = ratio
+        self.burst = burst
+        self._tokens = burst
+
+    def deposit(self):
+        self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+from .metrics import cache_requests
+
+
+
+logger = logging.getLogger(__name__)
+
+_FAILED = object()
+
+
+class StaleCache:
+    """Bounded in-process LRU cache that serves stale entries while refreshing them
+
+    An entry is fresh for `ttl` seconds, then for `stale_ttl` more seconds it is still
+    returned right away while one background task reloads it. Concurrent loads of one key
+    (misses or refreshes) share a single loader call, so the loader runs once per key
+    however many callers want it at the same time.
+
+    A `None` result of the loader means there is no value (e.g. it was deleted upstream):
+    the entry is dropped. A loader that raises failed: the stale value (if any) is kept,
+    and when loading a missing (or too stale) entry fails, the last value of the key is
+    returned however old it is. Values are shared between callers, they must not be
+    mutated.
+
+    Usage:
+    ------
+    ```python
+    cache = StaleCache(maxsize=1000, stale_ttl=600, name="catalog")
+    data = await cache.get_or_load(url, lambda: fetch(url), ttl=60)
+    ```
+    """
+    def __init__(self, maxsize:int, stale_ttl:float, name:str="stale"):
+        self.maxsize = maxsize
+        self.stale_ttl = stale_ttl
+        self.name = name  # label of the cache in `cache_requests` metric
+        self._entries : OrderedDict[str, tuple[Any, float, float]] = OrderedDict()  # value, fresh until, stale until
+        self._inflight : dict[str, asyncio.Task] = {}
+
+
+    def get(self, key:str) -> tuple[Any, bool]|None:
+        """Cached `(value, fresh)` of key, None if it is not cached (or too stale)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, fresh_until, stale_until = entry
+        now = time.monotonic()
+        if stale_until < now:
+            # kept (until evicted) as the fallback of failed loads, see `last`
+            return None
+        self._entries.move_to_end(key)
+        return value, fresh_until >= now
+
+    def set(self, key:str, value:Any, ttl:float):
+        now = time.monotonic()
+        self._entries[key] = (value, now + ttl, now + ttl + self.stale_ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def last(self, key:str) -> Any:
+        """Last loaded value of key however stale it is (None if there is none)"""
+        entry = self._entries.get(key)
+        return entry[0] if entry is not None else None
+
+    def clear(self):
+        self._entries.clear()
+
+
+    async def get_or_load(self, key:str, loader:Callable[[], Awaitable[Any]], ttl:float, fresh:bool=False) -> Any:
+        """Returns cached value of `key`, loading it on a miss
+
+        Args:
+        -----
+        - key `(str)`: _cache key_
+        - loader `(Callable)`: _coroutine function loading the value (`None` if there is none, raises if it failed)_
+        - ttl `(float)`: _seconds the loaded value is fresh_
+        - fresh `(bool)`: _skip cached values (the loaded one is still cached)_
+
+        Returns:
+        --------
+        `Any`: the (possibly stale) value, `None` if there is none (or loading failed without a previous value)
+        """
+        cached = None if fresh else self.get(key)
+        if cached is not None:
+            value, is_fresh = cached
+            cache_requests.inc(self.name, "hit" if is_fresh else "stale")
+            if not is_fresh:
+                # refreshed in background (the task is referenced by `_inflight` until done)
+                self._load(key, loader, ttl)
+            return value
+        cache_requests.inc(self.name, "miss")
+        # shielded so a cancelled caller does not cancel the load shared with others
+        value = await asyncio.shield(self._load(key, loader, ttl))
+        if value is _FAILED:
+            # e.g. the upstream is down, an outdated value is better than none
+            value = None if fresh else self.last(key)
+            if value is not None:
+                cache_requests.inc(self.name, "fallback")
+        return value
+
+    def _load(self, key, loader, ttl) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._run(key, loader, ttl))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return task
+
+    async def _run(self, key, loader, ttl):
+        try:
+            value = await loader()
+        except Exception as e:
+            logger.warning("loading `%s` failed: %r", key, e)
+            return _FAILED
+        if value is None:
+            self._entries.pop(key, None)
+        else:
+            self.set(key, value, ttl)
+        return value